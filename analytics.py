@@ -0,0 +1,283 @@
+import math
+import threading
+import time
+
+from array import array
+
+from main import _open_conn, read_version
+
+try:
+    import numpy as np
+except ImportError:  # NumPy là tuỳ chọn, không có thì chạy bản Python thuần
+    np = None
+
+
+DAY = 86400
+FETCH_BATCH = 50000
+
+
+class OrderLines:
+    # order_items dạng cột (struct-of-arrays): order_id, product_id, qty, unit_price, created_at
+    # chỉ nạp thêm dòng mới (order_items.id tăng dần), không đọc lại cả bảng mỗi lần
+    # chỉ giữ đơn ở bảng nóng: có đợt archive mới (Order.archive_db) => bỏ hết, nạp lại
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.order_id = array("q")
+        self.product_id = array("q")
+        self.qty = array("q")
+        self.unit_price = array("d")
+        self.created_at = array("d")  # NaN = đơn cũ không có timestamp
+        self.last_id = 0
+        self.archive_version = None
+
+    def __len__(self):
+        return len(self.qty)
+
+    def refresh(self):
+        conn = _open_conn()
+        try:
+            conn.execute("BEGIN")
+            archive_version = read_version(conn.cursor(), "orders_archive")
+            if archive_version != self.archive_version:
+                if self.archive_version is not None:
+                    self.clear()
+                self.archive_version = archive_version
+            cur = conn.execute("""
+                SELECT i.id, i.order_id, i.product_id, i.qty, i.unit_price, o.created_at
+                FROM order_items i
+                JOIN orders o ON o.order_id = i.order_id
+                WHERE i.id > ?
+                ORDER BY i.id
+            """, (self.last_id,))
+            while True:
+                batch = cur.fetchmany(FETCH_BATCH)
+                if not batch:
+                    break
+                ids, oids, pids, qtys, prices, created = zip(*batch)
+                self.order_id.extend(oids)
+                self.product_id.extend(pids)
+                self.qty.extend(qtys)
+                self.unit_price.extend(prices)
+                self.created_at.extend(math.nan if t is None else t for t in created)
+                self.last_id = ids[-1]
+        finally:
+            conn.close()
+
+    def reload(self):
+        self.clear()
+        self.refresh()
+
+
+order_lines = OrderLines()
+
+
+def _percentile_keys(percentiles):
+    return [f"qty_p{int(q) if float(q).is_integer() else q}" for q in percentiles]
+
+
+STAT_COLUMNS = ["product_id", "units_sold", "revenue", "order_hits", "avg_qty_per_order", "avg_unit_price"]
+
+
+def product_stats(percentiles=(50, 90), lines=None):
+    # thống kê cho mọi SKU 1 lượt: units, revenue, order_hits, trung bình, percentile qty/dòng
+    # trả về dạng cột {tên cột: list}, sắp theo product_id
+    lines = order_lines if lines is None else lines
+    with lines.lock:
+        if lines is order_lines:
+            lines.refresh()
+        if not len(lines):
+            return {name: [] for name in STAT_COLUMNS + _percentile_keys(percentiles)}
+        if np is not None:
+            return _product_stats_numpy(lines, percentiles)
+        return _product_stats_python(lines, percentiles)
+
+
+def _index_ids(pid):
+    # trả về (ids, inv, k): inv = chỉ số 0..k-1 của từng dòng
+    # product_id dày đặc => dùng thẳng id làm chỉ số (ids = None, lọc id không có dòng ở cuối)
+    hi = int(pid.max())
+    if pid.min() >= 0 and hi <= 4 * len(pid) + 1024:
+        return None, pid, hi + 1
+    ids, inv = np.unique(pid, return_inverse=True)
+    return ids, inv, len(ids)
+
+
+def _product_stats_numpy(lines, percentiles):
+    pid = np.frombuffer(lines.product_id, dtype=np.int64)
+    oid = np.frombuffer(lines.order_id, dtype=np.int64)
+    qty = np.frombuffer(lines.qty, dtype=np.int64)
+    price = np.frombuffer(lines.unit_price, dtype=np.float64)
+
+    ids, inv, k = _index_ids(pid)
+
+    counts = np.bincount(inv, minlength=k)
+    units = np.bincount(inv, weights=qty, minlength=k)
+    revenue = np.bincount(inv, weights=qty * price, minlength=k)
+
+    # order_hits = số dòng - số dòng trùng cặp (order, product): sort key ghép, dòng trùng nằm liền nhau
+    # (dòng đã theo thứ tự order nên gần như sắp sẵn => sort stable chạy rất nhanh)
+    pairs = np.sort(oid * k + inv, kind="stable")
+    dups = pairs[1:][pairs[1:] == pairs[:-1]]
+    hits = counts - np.bincount(dups % k, minlength=k)
+
+    q_min = int(qty.min())
+    span = int(qty.max()) - q_min + 1
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    if k * span <= 4 * len(qty) + 1024:
+        # qty ít giá trị khác nhau => histogram (product, qty) rồi cộng dồn, không cần sort n dòng
+        cum = np.bincount(inv * span + (qty - q_min), minlength=k * span).reshape(k, span).cumsum(axis=1)
+        kth = lambda rows, rank: (cum[rows] <= rank[:, None]).sum(axis=1) + q_min
+    else:
+        # sort key (product, qty) => mỗi product là 1 đoạn liên tiếp đã sắp
+        sorted_keys = np.sort(inv * span + (qty - q_min))
+        kth = lambda rows, rank: sorted_keys[starts[rows] + rank] % span + q_min
+
+    # chỉ giữ sản phẩm có bán
+    present = np.flatnonzero(counts)
+    if ids is None:
+        ids = present
+    else:
+        ids = ids[present]
+
+    percentile_cols = {}
+    for key, q in zip(_percentile_keys(percentiles), percentiles):
+        # nội suy tuyến tính giữa 2 phần tử kề nhau (giống numpy.percentile mặc định)
+        pos = (counts[present] - 1) * (q / 100)
+        lo = np.floor(pos).astype(np.int64)
+        hi = np.ceil(pos).astype(np.int64)
+        a = kth(present, lo).astype(np.float64)
+        b = kth(present, hi).astype(np.float64)
+        percentile_cols[key] = (a + (b - a) * (pos - lo)).tolist()
+
+    units = units[present]
+    revenue = revenue[present]
+    hits = hits[present]
+    return {
+        "product_id": ids.tolist(),
+        "units_sold": units.astype(np.int64).tolist(),
+        "revenue": revenue.tolist(),
+        "order_hits": hits.tolist(),
+        "avg_qty_per_order": (units / np.maximum(hits, 1)).tolist(),
+        "avg_unit_price": (revenue / np.where(units > 0, units, 1)).tolist(),
+        **percentile_cols,
+    }
+
+
+def _product_stats_python(lines, percentiles):
+    per_product = {}  # pid -> [units, revenue, set(order_id), [qty...]]
+    for oid, pid, qty, price in zip(lines.order_id, lines.product_id, lines.qty, lines.unit_price):
+        s = per_product.get(pid)
+        if s is None:
+            s = per_product[pid] = [0, 0.0, set(), []]
+        s[0] += qty
+        s[1] += qty * price
+        s[2].add(oid)
+        s[3].append(qty)
+
+    keys = _percentile_keys(percentiles)
+    cols = {name: [] for name in STAT_COLUMNS + keys}
+    for pid in sorted(per_product):
+        units, revenue, orders, qtys = per_product[pid]
+        qtys.sort()
+        hits = len(orders)
+        cols["product_id"].append(pid)
+        cols["units_sold"].append(units)
+        cols["revenue"].append(revenue)
+        cols["order_hits"].append(hits)
+        cols["avg_qty_per_order"].append(units / hits if hits else 0.0)
+        cols["avg_unit_price"].append(revenue / units if units else 0.0)
+        for key, q in zip(keys, percentiles):
+            pos = (len(qtys) - 1) * (q / 100)
+            lo, hi = math.floor(pos), math.ceil(pos)
+            cols[key].append(qtys[lo] + (qtys[hi] - qtys[lo]) * (pos - lo))
+    return cols
+
+
+def stats_rows(stats, limit=None):
+    # kết quả dạng cột -> list dict theo dòng (chỉ dựng đúng số dòng cần trả về)
+    names = list(stats)
+    columns = [stats[name] for name in names]
+    n = len(columns[0]) if columns else 0
+    if limit is not None:
+        n = min(n, limit)
+    return [{name: col[i] for name, col in zip(names, columns)} for i in range(n)]
+
+
+REORDER_COLUMNS = ["product_id", "qty_left", "estimated_daily_demand", "days_of_cover", "recommended_reorder_qty"]
+
+
+def reorder_suggestions(stock, target_days=7, lookback_days=30, now=None, lines=None):
+    # stock: {product_id: qty hiện có}; nhu cầu/ngày = units bán trong cửa sổ / số ngày
+    # trả về dạng cột, món cần nhập nhiều nhất lên đầu
+    lines = order_lines if lines is None else lines
+    now = time.time() if now is None else now
+    since = now - lookback_days * DAY
+
+    with lines.lock:
+        if lines is order_lines:
+            lines.refresh()
+        if np is not None:
+            return _reorder_numpy(lines, stock, since, lookback_days, target_days)
+        return _reorder_python(lines, stock, since, lookback_days, target_days)
+
+
+def _reorder_numpy(lines, stock, since, lookback_days, target_days):
+    ids = np.fromiter(stock.keys(), dtype=np.int64, count=len(stock))
+    left = np.fromiter(stock.values(), dtype=np.float64, count=len(stock))
+    sold = np.zeros(len(ids))
+
+    if len(lines) and len(ids):
+        pid = np.frombuffer(lines.product_id, dtype=np.int64)
+        qty = np.frombuffer(lines.qty, dtype=np.int64)
+        created = np.frombuffer(lines.created_at, dtype=np.float64)
+        mask = created >= since  # NaN => False
+        if mask.any():
+            win_ids, win_inv, k = _index_ids(pid[mask])
+            units = np.bincount(win_inv, weights=qty[mask], minlength=k)
+            if win_ids is None:
+                # chỉ số = product_id
+                inside = (ids >= 0) & (ids < k)
+                sold[inside] = units[ids[inside]]
+            else:
+                # tra units của từng SKU bằng searchsorted (win_ids đã sắp)
+                pos = np.clip(np.searchsorted(win_ids, ids), 0, k - 1)
+                sold = np.where(win_ids[pos] == ids, units[pos], 0.0)
+
+    daily = sold / lookback_days
+    reorder = np.maximum(0, np.round(daily * target_days - left)).astype(np.int64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cover = np.where(daily > 0, np.round(left / daily, 2), np.nan)
+
+    order = np.argsort(-reorder, kind="stable")
+    return {
+        "product_id": ids[order].tolist(),
+        "qty_left": left[order].astype(np.int64).tolist(),
+        "estimated_daily_demand": np.round(daily[order], 2).tolist(),
+        "days_of_cover": [None if c != c else c for c in cover[order].tolist()],
+        "recommended_reorder_qty": reorder[order].tolist(),
+    }
+
+
+def _reorder_python(lines, stock, since, lookback_days, target_days):
+    sold = {}
+    for p, q, t in zip(lines.product_id, lines.qty, lines.created_at):
+        if t >= since:
+            sold[p] = sold.get(p, 0) + q
+
+    rows = []
+    for pid, qty_left in stock.items():
+        d = sold.get(pid, 0) / lookback_days
+        rows.append((pid, qty_left, d, max(0, int(round(d * target_days - qty_left)))))
+    rows.sort(key=lambda r: r[3], reverse=True)
+
+    return {
+        "product_id": [r[0] for r in rows],
+        "qty_left": [r[1] for r in rows],
+        "estimated_daily_demand": [round(r[2], 2) for r in rows],
+        "days_of_cover": [(round(r[1] / r[2], 2) if r[2] > 0 else None) for r in rows],
+        "recommended_reorder_qty": [r[3] for r in rows],
+    }
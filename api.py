@@ -1,10 +1,73 @@
-from fastapi import FastAPI
-from pydantic import BaseModel
-
-from main import Product, Order, get_conn, init_db
+import asyncio
+import io
+import os
+import tempfile
+import threading
+import time
+
+from typing import Literal
+
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.routing import APIRoute
+from pydantic import BaseModel, Field
+
+import analytics
+import forecast
+import main
+import metrics
+from cache import ResponseCache
+from main import (
+    HOLD_TTL_SECONDS, IDEMPOTENCY_CONFLICT, MAX_HOLD_TTL_SECONDS, PARTIAL_STOCK_POLICIES,
+    ChangeLogExpired, Order, OrderRejected, Product, Reservation,
+    close_all_conns, compact_change_log, init_db, iter_csv_chunks, iter_product_rows, open_change_feed,
+)
+from order_queue import OrderWriter
+
+
+class ProfiledRoute(APIRoute):
+    # cProfile chỉ thấy thread đang bật nó => bọc endpoint để profile chạy đúng thread của route
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, metrics.profiled(endpoint, path), **kwargs)
 
 
 app = FastAPI(title="Inventory API")
+if metrics.PROFILE_DIR:
+    app.router.route_class = ProfiledRoute
+
+# INVENTORY_ASYNC_ORDERS=1 => mọi ghi đơn/kho đi qua 1 writer asyncio (group commit)
+ASYNC_ORDERS = os.getenv("INVENTORY_ASYNC_ORDERS", "0") == "1"
+order_writer: OrderWriter | None = None
+
+# chu kỳ quét reservation hết hạn / dọn Idempotency-Key quá hạn (giây)
+HOLD_SWEEP_SECONDS = float(os.getenv("INVENTORY_HOLD_SWEEP_SECONDS", "5"))
+IDEMPOTENCY_COMPACT_SECONDS = float(os.getenv("INVENTORY_IDEMPOTENCY_COMPACT_SECONDS", "3600"))
+CHANGE_LOG_COMPACT_SECONDS = float(os.getenv("INVENTORY_CHANGE_LOG_COMPACT_SECONDS", "3600"))
+# > 0 => đơn cũ hơn N ngày được chuyển sang bảng archive mỗi ORDER_ARCHIVE_SECONDS
+ORDER_RETENTION_DAYS = float(os.getenv("INVENTORY_ORDER_RETENTION_DAYS", "0"))
+ORDER_ARCHIVE_SECONDS = float(os.getenv("INVENTORY_ORDER_ARCHIVE_SECONDS", "3600"))
+MAX_IDEMPOTENCY_KEY_LENGTH = 255
+# POST /orders/batch: số đơn tối đa mỗi request + chính sách mặc định khi thiếu hàng (reject | fill)
+MAX_BATCH_ORDERS = int(os.getenv("INVENTORY_MAX_BATCH_ORDERS", "1000"))
+PARTIAL_STOCK_POLICY = os.getenv("INVENTORY_PARTIAL_STOCK_POLICY", "reject")
+if PARTIAL_STOCK_POLICY not in PARTIAL_STOCK_POLICIES:
+    raise RuntimeError(f"INVENTORY_PARTIAL_STOCK_POLICY must be one of {PARTIAL_STOCK_POLICIES}")
+maintenance_task: asyncio.Task | None = None
+
+# INVENTORY_FAST_STARTUP=1 => nạp cache sản phẩm từ snapshot (nếu còn hợp lệ), history nạp nền
+# snapshot được ghi lại định kỳ + lúc shutdown
+FAST_STARTUP = os.getenv("INVENTORY_FAST_STARTUP", "0") == "1"
+SNAPSHOT_FILE = os.getenv("INVENTORY_SNAPSHOT_FILE") or None  # mặc định: <DB_FILE>.snapshot
+SNAPSHOT_SECONDS = float(os.getenv("INVENTORY_SNAPSHOT_SECONDS", "300"))
+# trạng thái khởi động, trả qua /health/ready
+warmup = {"products": None, "history": "pending"}
+
+# cache kết quả /ai/*: tự hết hiệu lực khi products/orders đổi version
+ai_cache = ResponseCache(
+    max_entries=int(os.getenv("INVENTORY_AI_CACHE_SIZE", "256")),
+    ttl_seconds=float(os.getenv("INVENTORY_AI_CACHE_TTL", "60")),
+)
 
 
 # ----- MODELS (forms) -----
@@ -26,24 +89,224 @@ class OrderCreate(BaseModel):
     items: list[OrderItem]
 
 
+class BatchOrder(OrderCreate):
+    # key riêng cho từng đơn (vd id đơn bên marketplace) => gửi lại cả batch không bị ghi trùng
+    idempotency_key: str | None = None
+
+
+class OrderBatch(BaseModel):
+    orders: list[BatchOrder]
+    policy: Literal["reject", "fill"] | None = None  # None => INVENTORY_PARTIAL_STOCK_POLICY
+
+
+class HoldCreate(BaseModel):
+    customer: str | None = None
+    items: list[OrderItem]
+    ttl_seconds: float = Field(HOLD_TTL_SECONDS, gt=0, le=MAX_HOLD_TTL_SECONDS)
+
+
+class HoldExtend(BaseModel):
+    ttl_seconds: float = Field(HOLD_TTL_SECONDS, gt=0, le=MAX_HOLD_TTL_SECONDS)
+
+
+class HoldCommit(BaseModel):
+    customer: str | None = None
+
+
 # ----- STARTUP -----
+def snapshot_path():
+    return SNAPSHOT_FILE or f"{main.DB_FILE}.snapshot"
+
+
 @app.on_event("startup")
 def startup():
+    t0 = time.perf_counter()
     # tạo DB/bảng nếu chưa có
     init_db()
     # load cache từ DB vào RAM (để Product.find_by_id hoạt động)
-    Product.load_from_db()
-    Order.load_history_from_db()
+    # snapshot còn hợp lệ => không SELECT cả bảng, chỉ bù các dòng đổi sau lúc chụp
+    if FAST_STARTUP and Product.load_snapshot(snapshot_path()):
+        warmup["products"] = "snapshot"
+    else:
+        Product.load_from_db()
+        warmup["products"] = "db"
+    warmup["products_loaded"] = len(Product.inventory)
+    warmup["startup_seconds"] = round(time.perf_counter() - t0, 4)
+
+    # API không cần orders_history để phục vụ (đơn đọc/ghi thẳng DB) => nạp nền, nhận traffic ngay
+    if FAST_STARTUP:
+        threading.Thread(target=load_history, name="history-warmup", daemon=True).start()
+    else:
+        load_history()
+
+
+def load_history():
+    t0 = time.perf_counter()
+    warmup["history"] = "loading"
+    try:
+        Order.load_history_from_db()
+        # bù các đơn ghi trong lúc đang nạp
+        Order.refresh_from_db()
+    except Exception as e:
+        warmup["history"] = f"failed: {e}"
+        return
+    warmup["history"] = "ready"
+    warmup["history_seconds"] = round(time.perf_counter() - t0, 4)
+
+
+@app.on_event("startup")
+async def start_order_writer():
+    global order_writer
+    if ASYNC_ORDERS:
+        order_writer = OrderWriter()
+        await order_writer.start()
+
+
+@app.on_event("startup")
+async def start_maintenance():
+    global maintenance_task
+    maintenance_task = asyncio.create_task(maintenance_loop())
+
+
+async def maintenance_loop():
+    # trả lại hàng của reservation hết hạn (theo batch, xem Reservation.expire_db)
+    # + thỉnh thoảng dọn Idempotency-Key quá hạn, change_log và archive đơn cũ
+    next_compact = time.monotonic() + IDEMPOTENCY_COMPACT_SECONDS
+    next_log_compact = time.monotonic() + CHANGE_LOG_COMPACT_SECONDS
+    next_archive = time.monotonic() + ORDER_ARCHIVE_SECONDS
+    next_snapshot = time.monotonic() + SNAPSHOT_SECONDS
+    while True:
+        await asyncio.sleep(HOLD_SWEEP_SECONDS)
+        try:
+            await run_write(Reservation.expire_db)
+            if time.monotonic() >= next_compact:
+                await run_write(Order.compact_idempotency_keys)
+                next_compact = time.monotonic() + IDEMPOTENCY_COMPACT_SECONDS
+            if time.monotonic() >= next_log_compact:
+                await run_write(compact_change_log)
+                next_log_compact = time.monotonic() + CHANGE_LOG_COMPACT_SECONDS
+            if ORDER_RETENTION_DAYS > 0 and time.monotonic() >= next_archive:
+                await run_write(Order.archive_db, ORDER_RETENTION_DAYS * 86400)
+                next_archive = time.monotonic() + ORDER_ARCHIVE_SECONDS
+            if FAST_STARTUP and time.monotonic() >= next_snapshot:
+                await run_in_threadpool(Product.save_snapshot, snapshot_path())
+                next_snapshot = time.monotonic() + SNAPSHOT_SECONDS
+        except Exception:
+            # lỗi tạm thời (DB bận...) => lần quét sau làm lại
+            continue
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    global order_writer, maintenance_task
+    if maintenance_task:
+        maintenance_task.cancel()
+        maintenance_task = None
+    if order_writer:
+        await order_writer.stop()
+        order_writer = None
+    if FAST_STARTUP:
+        try:
+            Product.save_snapshot(snapshot_path())
+        except OSError:
+            pass  # không ghi được thì lần sau load từ DB
+    close_all_conns()
 
 
 # ----- HELPERS -----
-def next_order_id() -> int:
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT COALESCE(MAX(order_id), 0) + 1 FROM orders")
-    oid = cur.fetchone()[0]
-    conn.close()
-    return oid
+def product_to_dict(p: Product) -> dict:
+    return {
+        "id": p.product_id,
+        "name": p.name,
+        "category": p.category,
+        "quantity": p.quantity,
+        "price": p.price,
+        "supplier": p.supplier,
+        "reserved": p.reserved,
+        "available": p.available,
+    }
+
+
+# tên field trong JSON -> attribute của Product
+PRODUCT_FIELDS = {
+    "id": "product_id",
+    "name": "name",
+    "category": "category",
+    "quantity": "quantity",
+    "price": "price",
+    "supplier": "supplier",
+    "reserved": "reserved",
+    "available": "available",
+}
+MAX_PAGE_SIZE = 1000
+
+
+def parse_fields(fields):
+    # "id,name,quantity" -> [(json_name, attr), ...]; None => đủ field
+    if fields is None:
+        return None
+    names = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = [f for f in names if f not in PRODUCT_FIELDS]
+    if unknown or not names:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown) or fields}")
+    return [(f, PRODUCT_FIELDS[f]) for f in dict.fromkeys(names)]
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # so sánh weak: bỏ tiền tố W/
+    tags = [t.strip().removeprefix("W/") for t in header.split(",")]
+    return etag.removeprefix("W/") in tags
+
+
+def hold_to_dict(h: Reservation) -> dict:
+    return {
+        "hold_id": h.hold_id,
+        "customer": h.customer,
+        "items": [{"product_id": pid, "qty": qty} for pid, qty in h.items],
+        "created_at": h.created_at,
+        "expires_at": h.expires_at,
+    }
+
+
+async def run_write(fn, *args):
+    # ghi DB: qua writer (giữ thứ tự với các đơn khác) nếu bật, không thì threadpool
+    if order_writer:
+        return await order_writer.submit(fn, *args)
+    return await run_in_threadpool(fn, *args)
+
+
+def csv_response(rows, filename):
+    # generator sync => Starlette đọc trong threadpool, không block event loop
+    return StreamingResponse(
+        iter_csv_chunks(rows),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+# ----- MIDDLEWARE -----
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    # latency + số query / rows / connection mở trong từng request, gom theo route (path mẫu)
+    profile = request.headers.get("x-profile") == "1" or request.query_params.get("profile") == "1"
+    stats, token = metrics.begin_request(profile)
+    status = 500
+    t0 = time.perf_counter()
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        metrics.end_request(token, route, request.method, status, time.perf_counter() - t0)
+
+    if stats.profile_file:
+        response.headers["X-Profile-File"] = stats.profile_file
+    return response
 
 
 # ----- ROUTES -----
@@ -52,137 +315,320 @@ def root():
     return {"message": "hello from inventory api"}
 
 
+@app.get("/health/ready")
+def health_ready(response: Response):
+    # sẵn sàng khi cache sản phẩm đã nạp; history có thể vẫn đang nạp nền (không chặn traffic)
+    ready = warmup["products"] is not None
+    if not ready:
+        response.status_code = 503
+    return {"ready": ready, **warmup}
+
+
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/products")
-def get_products():
-    Product.load_from_db()
-    return [
-        {
-            "id": p.product_id,
-            "name": p.name,
-            "category": p.category,
-            "quantity": p.quantity,
-            "price": p.price,
-            "supplier": p.supplier,
-        }
-        for p in Product.inventory
-    ]
+def get_products(
+    request: Request,
+    response: Response,
+    category: str | None = None,
+    supplier: str | None = None,
+    min_qty: int | None = None,
+    max_qty: int | None = None,
+    after_id: int | None = None,
+    limit: int | None = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    fields: str | None = None,
+):
+    # fields sai => 400 kể cả khi ETag khớp (validate trước khi trả 304)
+    projection = parse_fields(fields)
+
+    # chỉ reload khi DB đổi (so version), còn lại đọc thẳng cache
+    Product.refresh_from_db()
+
+    # ETag theo version bảng products: kho chưa đổi => 304, không serialize gì cả
+    # (ETag gắn với URL nên các query khác nhau vẫn dùng chung version được)
+    etag = f'W/"products-{Product._version}"'
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    # lọc qua index category/supplier, không quét cả kho
+    items, next_after_id = Product.page(after_id, limit, category, supplier, min_qty, max_qty)
+
+    response.headers["ETag"] = etag
+    if next_after_id is not None:
+        response.headers["X-Next-After-Id"] = str(next_after_id)
+    if projection is None:
+        return [product_to_dict(p) for p in items]
+    return [{name: getattr(p, attr) for name, attr in projection} for p in items]
+
+
+@app.get("/products/{product_id}")
+def get_product(product_id: int):
+    Product.refresh_from_db()
+    p = Product.find_by_id(product_id)
+    if not p:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return product_to_dict(p)
 
 
 @app.post("/products")
-def create_product(data: ProductCreate):
-    msg = Product.add_product_db(
-        data.name, data.category, data.quantity, data.price, data.supplier
-    )
+async def create_product(data: ProductCreate):
+    args = (data.name, data.category, data.quantity, data.price, data.supplier)
+    msg = await run_write(Product.add_product_db, *args)
     return {"ok": True, "message": msg}
 
 
+@app.post("/products/bulk")
+async def bulk_import_products(request: Request, format: str | None = None):
+    # body: CSV (header name,category,quantity,price,supplier[,product_id]) hoặc NDJSON
+    fmt = format
+    if fmt is None:
+        content_type = request.headers.get("content-type", "")
+        fmt = "ndjson" if "json" in content_type else "csv"
+    if fmt not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be csv or ndjson")
+
+    # spool body ra file tạm theo từng chunk => RAM không phụ thuộc kích thước feed
+    spool = tempfile.TemporaryFile()
+    try:
+        async for chunk in request.stream():
+            spool.write(chunk)
+        spool.seek(0)
+
+        def run_import():
+            text = io.TextIOWrapper(spool, encoding="utf-8", newline="")
+            return Product.bulk_upsert_db(iter_product_rows(text, fmt))
+
+        report = await run_write(run_import)
+    finally:
+        spool.close()
+
+    return {"ok": report["error_count"] == 0, **report}
+
+
+def idempotency_key(request: Request) -> str | None:
+    key = request.headers.get("idempotency-key")
+    if key is not None and not 0 < len(key) <= MAX_IDEMPOTENCY_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail="Invalid Idempotency-Key")
+    return key
+
+
+def order_result(response: Response, order: Order, msg, total):
+    if msg == IDEMPOTENCY_CONFLICT:
+        raise HTTPException(status_code=422, detail=msg)
+    if order.replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    if total is None:
+        return {"ok": False, "message": msg}
+    return {"ok": True, "order_id": order.order_id, "message": msg, "total": total}
+
+
 @app.post("/orders")
-def create_order(data: OrderCreate):
-    # refresh cache để đảm bảo đúng stock mới nhất
-    Product.load_from_db()
+async def create_order(data: OrderCreate, request: Request, response: Response):
+    # order_id do DB cấp bên trong transaction ghi đơn (không còn MAX(order_id) + 1 riêng lẻ)
+    order = Order(order_id=None, products=[], customer_info=data.customer, idempotency_key=idempotency_key(request))
+    items = [(it.product_id, it.qty) for it in data.items]
+
+    # retry cùng Idempotency-Key: 1 lần tra index rồi trả kết quả cũ, không vào hàng đợi ghi
+    if order.idempotency_key:
+        replay = await run_in_threadpool(order.replay_if_seen, items)
+        if replay is not None:
+            return order_result(response, order, *replay)
+
+    # trừ kho + ghi đơn (+ lưu key) trong 1 transaction, lỗi thì rollback toàn bộ
+    if order_writer:
+        msg, total = await order_writer.submit_order(order, items)
+    else:
+        msg, total = await run_in_threadpool(order.place_order_db, items)
+    return order_result(response, order, msg, total)
+
+
+@app.post("/orders/batch")
+async def create_order_batch(data: OrderBatch):
+    # kiểm tra tồn kho cả batch trên 1 snapshot, ghi theo chunk transaction; kết quả riêng từng đơn
+    if len(data.orders) > MAX_BATCH_ORDERS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_ORDERS} orders per batch")
+    for o in data.orders:
+        if o.idempotency_key is not None and not 0 < len(o.idempotency_key) <= MAX_IDEMPOTENCY_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail="Invalid idempotency_key")
+
+    policy = data.policy or PARTIAL_STOCK_POLICY
+    requests = [
+        (Order(order_id=None, products=[], customer_info=o.customer, idempotency_key=o.idempotency_key),
+         [(it.product_id, it.qty) for it in o.items])
+        for o in data.orders
+    ]
+    # đi qua writer (nếu bật) như mọi thao tác ghi khác => giữ thứ tự với POST /orders
+    outcomes = await run_write(Order.place_batch_db, requests, policy)
 
-    oid = next_order_id()
-    order = Order(order_id=oid, products=[], customer_info=data.customer)
+    results = []
+    for index, ((order, items), (msg, total)) in enumerate(zip(requests, outcomes)):
+        result = {"index": index, "ok": total is not None, "message": msg}
+        if order.idempotency_key is not None:
+            result["idempotency_key"] = order.idempotency_key
+            result["replayed"] = order.replayed
+        if total is not None:
+            result.update(order_id=order.order_id, total=total)
+            if not order.replayed:
+                # dòng đã bán thật sự (policy fill có thể ít hơn số yêu cầu)
+                requested, filled = {}, {}
+                for pid, qty in items:
+                    requested[pid] = requested.get(pid, 0) + qty
+                for pid, qty in order.products:
+                    filled[pid] = filled.get(pid, 0) + qty
+                result["items"] = [
+                    {"product_id": pid, "requested": qty, "filled": filled.get(pid, 0)}
+                    for pid, qty in requested.items()
+                ]
+                result["partial"] = any(line["filled"] < line["requested"] for line in result["items"])
+        results.append(result)
+
+    accepted = sum(r["ok"] for r in results)
+    return {"policy": policy, "accepted": accepted, "rejected": len(results) - accepted, "results": results}
+
+
+@app.get("/orders/{order_id}")
+def get_order(order_id: int):
+    # đơn gần đây lấy từ RAM, đơn đã archive đọc từ DB khi cần
+    o = Order.find_order(order_id)
+    if not o:
+        raise HTTPException(status_code=404, detail="Order not found")
+    return {**o, "items": [{"product_id": pid, "qty": qty, "unit_price": price} for pid, qty, price in o["items"]]}
+
+# ----- HOLDS (giữ hàng có hạn cho checkout nhiều bước) -----
+@app.post("/holds")
+async def create_hold(data: HoldCreate):
+    items = [(it.product_id, it.qty) for it in data.items]
+    try:
+        hold = await run_write(Reservation.hold_db, items, data.ttl_seconds, data.customer)
+    except OrderRejected as e:
+        return {"ok": False, "message": str(e)}
+    return {"ok": True, **hold_to_dict(hold)}
+
+
+@app.get("/holds/{hold_id}")
+def get_hold(hold_id: int):
+    hold = Reservation.find_db(hold_id)
+    if not hold:
+        raise HTTPException(status_code=404, detail="Hold not found")
+    return hold_to_dict(hold)
+
+
+@app.post("/holds/{hold_id}/extend")
+async def extend_hold(hold_id: int, data: HoldExtend):
+    try:
+        hold = await run_write(Reservation.extend_db, hold_id, data.ttl_seconds)
+    except OrderRejected as e:
+        return {"ok": False, "message": str(e)}
+    if not hold:
+        raise HTTPException(status_code=404, detail="Hold not found or expired")
+    return {"ok": True, **hold_to_dict(hold)}
+
+
+@app.post("/holds/{hold_id}/commit")
+async def commit_hold(hold_id: int, request: Request, response: Response, data: HoldCommit | None = None):
+    # chỉ chuyển reserved -> đã bán + ghi đơn, không kiểm tra lại tồn kho
+    order = Order(
+        order_id=None, products=[], customer_info=data.customer if data else None,
+        idempotency_key=idempotency_key(request),
+    )
+    if order.idempotency_key:
+        replay = await run_in_threadpool(order.replay_if_seen, hold_id)
+        if replay is not None:
+            return order_result(response, order, *replay)
+
+    msg, total = await run_write(order.commit_hold_db, hold_id)
+    return order_result(response, order, msg, total)
+
+
+@app.delete("/holds/{hold_id}")
+async def release_hold(hold_id: int):
+    if not await run_write(Reservation.release_db, hold_id):
+        raise HTTPException(status_code=404, detail="Hold not found")
+    return {"ok": True}
 
-    for it in data.items:
-        msg = order.place_order(it.product_id, it.qty, data.customer)
-        if "could not be placed" in msg:
-            return {"ok": False, "message": msg}
 
-    msg2 = order.checkout_db()
-    return {"ok": True, "order_id": oid, "message": msg2, "total": order.total_price()}
+@app.get("/reports/revenue")
+def report_revenue():
+    return Order.sales_totals()
+
+
+@app.get("/reports/top-selling")
+def report_top_selling(limit: int = 10):
+    return {"results": Order.top_selling(limit=max(limit, 0))}
+
 
 @app.get("/ai/low-stock-forecast")
-def low_stock_forecast(lookback_orders: int = 10, threshold: int = 2):
-    # load dữ liệu mới nhất
-    Product.load_from_db()
-    Order.load_history_from_db()
-
-    # lấy N đơn gần nhất
-    recent = Order.orders_history[-lookback_orders:] if lookback_orders > 0 else Order.orders_history
-
-    # đếm bán trung bình mỗi đơn
-    sold_counts = {}   # pid -> total qty sold in recent orders
-    order_hits = {}    # pid -> number of orders that contain this pid
-
-    for o in recent:
-        seen_in_this_order = set()
-        for pid, qty in o["items"]:
-            sold_counts[pid] = sold_counts.get(pid, 0) + qty
-            if pid not in seen_in_this_order:
-                order_hits[pid] = order_hits.get(pid, 0) + 1
-                seen_in_this_order.add(pid)
+def low_stock_forecast(lookback_orders: int = 10, threshold: int = 2, lookback_days: float | None = None):
+    # cửa sổ = N đơn gần nhất (hoặc lookback_days), đọc từ bucket nhu cầu, không load lịch sử
+    def compute():
+        Product.refresh_from_db()
+        return forecast.low_stock_forecast(lookback_orders, threshold, lookback_days)
 
-    results = []
-    for p in Product.inventory:
-        if p.quantity <= threshold:
-            pid = p.product_id
-            total_sold = sold_counts.get(pid, 0)
-            hits = order_hits.get(pid, 0)
-
-            # avg qty per order (chỉ tính những đơn có món đó)
-            avg_per_order = (total_sold / hits) if hits > 0 else 0
-
-            # dự đoán còn bao nhiêu đơn nữa hết
-            est_orders_left = (p.quantity / avg_per_order) if avg_per_order > 0 else None
-
-            results.append({
-                "product_id": pid,
-                "product_name": p.name,
-                "qty_left": p.quantity,
-                "lookback_orders": lookback_orders,
-                "avg_sold_per_order": round(avg_per_order, 2),
-                "estimated_orders_left": (round(est_orders_left, 2) if est_orders_left is not None else None),
-                "note": ("not enough data" if avg_per_order == 0 else "ok")
-            })
+    params = {"lookback_orders": lookback_orders, "threshold": threshold, "lookback_days": lookback_days}
+    return ai_cache.get_or_compute("low-stock-forecast", params, compute)
 
-    return {
-        "threshold": threshold,
-        "results": results
-    }
 
 @app.get("/ai/reorder-suggest")
-def reorder_suggest(lookback_orders: int = 20, target_days: int = 7):
-    Product.load_from_db()
-    Order.load_history_from_db()
+def reorder_suggest(lookback_orders: int = 20, target_days: int = 7, lookback_days: float | None = None):
+    def compute():
+        Product.refresh_from_db()
+        return forecast.reorder_suggest(lookback_orders, target_days, lookback_days)
 
-    recent = Order.orders_history[-lookback_orders:] if lookback_orders > 0 else Order.orders_history
+    params = {"lookback_orders": lookback_orders, "target_days": target_days, "lookback_days": lookback_days}
+    return ai_cache.get_or_compute("reorder-suggest", params, compute)
 
-    # đếm bán tổng
-    sold_counts = {}  # pid -> total qty sold
-    for o in recent:
-        for pid, qty in o["items"]:
-            sold_counts[pid] = sold_counts.get(pid, 0) + qty
 
-    # ước lượng "đơn per day": giả lập đơn nào cũng như nhau => coi lookback_orders ~ target window
-    # để đơn giản: lấy avg per order rồi nhân "orders_per_day" giả lập = 1
-    # (m muốn xịn hơn thì bước sau tao thêm timestamp thật)
-    orders_per_day = 1
+@app.get("/ai/product-stats")
+def product_stats(limit: int | None = None):
+    # thống kê theo SKU trên toàn bộ order lines (vector hoá bằng NumPy nếu có)
+    def compute():
+        stats = analytics.product_stats()
+        return {"vectorized": analytics.np is not None, "results": analytics.stats_rows(stats, limit)}
 
-    results = []
-    for p in Product.inventory:
-        pid = p.product_id
-        total_sold = sold_counts.get(pid, 0)
+    return ai_cache.get_or_compute("product-stats", {"limit": limit}, compute)
+
+
+@app.get("/ai/reorder-batch")
+def reorder_batch(
+    target_days: int = Query(7, ge=0),
+    lookback_days: float = Query(30, gt=0),  # chia cho lookback_days => 0 hay âm là sai
+    limit: int | None = Query(None, ge=1),
+):
+    def compute():
+        Product.refresh_from_db()
+        stock = {p.product_id: p.quantity for p in Product.inventory}
+        suggestions = analytics.reorder_suggestions(stock, target_days, lookback_days)
+        return {"vectorized": analytics.np is not None, "results": analytics.stats_rows(suggestions, limit)}
+
+    params = {"target_days": target_days, "lookback_days": lookback_days, "limit": limit}
+    return ai_cache.get_or_compute("reorder-batch", params, compute)
+
+
+@app.get("/ai/cache-stats")
+def ai_cache_stats():
+    return ai_cache.stats()
 
-        # avg sold per order
-        avg_per_order = (total_sold / lookback_orders) if lookback_orders > 0 else 0
-        daily_demand = avg_per_order * orders_per_day
 
-        need_for_days = daily_demand * target_days
-        reorder_qty = max(0, int(round(need_for_days - p.quantity)))
+# ----- CHANGE FEED -----
+@app.get("/changes")
+def changes(since: int = Query(0, ge=0), limit: int | None = Query(None, ge=1)):
+    # NDJSON, 1 dòng/thay đổi theo seq tăng dần; since lần sau = seq dòng cuối
+    # (hoặc X-Change-Seq nếu đã đọc hết, không truyền limit)
+    try:
+        head, lines = open_change_feed(since, limit)
+    except ChangeLogExpired as e:
+        raise HTTPException(status_code=410, detail=str(e))
+    return StreamingResponse(lines, media_type="application/x-ndjson", headers={"X-Change-Seq": str(head)})
 
-        results.append({
-            "product_id": pid,
-            "product_name": p.name,
-            "qty_left": p.quantity,
-            "lookback_orders": lookback_orders,
-            "target_days": target_days,
-            "estimated_daily_demand": round(daily_demand, 2),
-            "recommended_reorder_qty": reorder_qty
-        })
 
-    # ưu tiên món cần nhập nhiều nhất lên đầu
-    results.sort(key=lambda x: x["recommended_reorder_qty"], reverse=True)
+@app.get("/exports/orders.csv")
+def export_orders():
+    return csv_response(Order.iter_orders_export_rows(), "orders_history.csv")
 
-    return {"results": results}
 
+@app.get("/exports/sales-report.csv")
+def export_sales_report(low_stock_threshold: int = 2):
+    return csv_response(Order.iter_sales_report_rows(low_stock_threshold), "sales_report.csv")
@@ -0,0 +1,481 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import main as inventory
+from main import (
+    Order, Product, backfill_order_totals, close_all_conns, init_db, rebuild_sales_aggregates, transaction,
+)
+
+
+DAY = 86400
+DEFAULT_DB = os.path.join(tempfile.gettempdir(), "bench_inventory.db")
+
+
+@dataclass
+class DictProduct:
+    # Product kiểu cũ (dataclass thường, mỗi object có __dict__) để so sánh
+    product_id: int
+    name: str
+    category: str
+    quantity: int
+    price: float
+    supplier: str
+
+
+def synthetic_rows(n, categories=50, suppliers=200):
+    # giống row từ sqlite: mỗi dòng là string mới, chưa được chia sẻ
+    for i in range(1, n + 1):
+        yield (
+            i,
+            f"Product {i}",
+            "".join(("category-", str(i % categories))),
+            "".join(("supplier-", str(i % suppliers))),
+            i % 100,
+            float(i % 1000) + 0.99,
+        )
+
+
+def _measure(build, rows):
+    tracemalloc.start()
+    try:
+        keep = build(rows)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del keep
+    return current, peak
+
+
+def _build_dict(rows):
+    # cùng các index như Product để chỉ khác nhau ở cách lưu record
+    inventory, by_id, by_category, by_supplier = [], {}, {}, {}
+    for pid, name, cat, sup, qty, price in rows:
+        p = DictProduct(pid, name, cat, qty, price, sup)
+        inventory.append(p)
+        by_id[pid] = p
+        by_category.setdefault(cat, []).append(p)
+        by_supplier.setdefault(sup, []).append(p)
+    return inventory, by_id, by_category, by_supplier
+
+
+def _build_slots(rows):
+    # Product thật: slots + intern + index (inventory, id, category, supplier)
+    Product.clear_cache()
+    for pid, name, cat, sup, qty, price in rows:
+        Product(pid, name, cat, qty, price, sup)
+    return Product.inventory
+
+
+def bench_memory(n):
+    results = {"products": n, "python": sys.version.split()[0], "representations": []}
+    for label, build in (("dataclass (__dict__)", _build_dict), ("Product (slots + interned + indexes)", _build_slots)):
+        # row sinh ra trong lúc đo => tính cả string mà cache giữ lại
+        current, peak = _measure(build, synthetic_rows(n))
+        results["representations"].append({
+            "name": label,
+            "bytes": current,
+            "peak_bytes": peak,
+            "bytes_per_product": round(current / n, 1),
+        })
+    Product.clear_cache()
+    return results
+
+
+# ----- SEED -----
+def seed_db(path, products, orders, lines_per_order=3, days=90, seed=42):
+    # DB riêng cho benchmark (không đụng inventory.db thật), dữ liệu cố định theo seed
+    rng = random.Random(seed)
+    close_all_conns()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    inventory.DB_FILE = path
+    init_db()
+
+    now = time.time()
+    with transaction() as cur:
+        cur.executemany(
+            "INSERT INTO products (product_id, name, category, quantity, price, supplier) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                (pid, f"Product {pid}", f"Category {pid % 50}", rng.randint(50, 500),
+                 round(rng.uniform(0.5, 100), 2), f"Supplier {pid % 200}")
+                for pid in range(1, products + 1)
+            ),
+        )
+        prices = dict(cur.execute("SELECT product_id, price FROM products").fetchall())
+
+        items = []
+        for oid in range(1, orders + 1):
+            # đơn trải đều trong `days` ngày gần nhất, theo thứ tự id
+            created = now - days * DAY * (1 - oid / orders)
+            cur.execute(
+                "INSERT INTO orders (order_id, customer, created_at) VALUES (?, ?, ?)",
+                (oid, f"customer-{rng.randint(1, 1000)}", created),
+            )
+            for pid in rng.sample(range(1, products + 1), min(lines_per_order, products)):
+                items.append((oid, pid, rng.randint(1, 5), prices[pid]))
+            if len(items) >= 10000:
+                cur.executemany("INSERT INTO order_items (order_id, product_id, qty, unit_price) VALUES (?, ?, ?, ?)", items)
+                items.clear()
+        cur.executemany("INSERT INTO order_items (order_id, product_id, qty, unit_price) VALUES (?, ?, ?, ?)", items)
+        backfill_order_totals(cur)
+        rebuild_sales_aggregates(cur)
+        # chỉ version dữ liệu (data_versions còn giữ db_instance, change_log_floor)
+        cur.execute("UPDATE data_versions SET version = version + 1 WHERE name IN ('products', 'orders', 'orders_archive')")
+    Product.clear_cache()
+    Order.orders_history.clear()
+    Order._version = None
+
+
+# ----- MEASURE -----
+def percentile(sorted_values, q):
+    # nearest-rank
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[k]
+
+
+def summarize(name, durations, ops_per_run=1, **extra):
+    durations = sorted(durations)
+    total = sum(durations)
+    return {
+        "name": name,
+        "runs": len(durations),
+        "ops": len(durations) * ops_per_run,
+        "total_s": round(total, 6),
+        "throughput_ops_s": round(len(durations) * ops_per_run / total, 2) if total else None,
+        "p50_ms": round(percentile(durations, 50) * 1000, 4),
+        "p99_ms": round(percentile(durations, 99) * 1000, 4),
+        "max_ms": round(durations[-1] * 1000, 4),
+        **extra,
+    }
+
+
+def timed(fn, runs):
+    durations = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - t0)
+    return durations
+
+
+def bench_core(args):
+    rng = random.Random(args.seed)
+    results = [
+        summarize("Product.load_from_db", timed(lambda: (Product.clear_cache(), Product.load_from_db()), args.repeat),
+                  rows=args.products),
+        summarize("Order.load_history_from_db", timed(Order.load_history_from_db, args.repeat), rows=args.orders),
+    ]
+
+    Product.load_from_db()
+    ids = [rng.randint(1, args.products) for _ in range(args.lookups)]
+    it = iter(ids)
+    results.append(summarize("Product.find_by_id", timed(lambda: Product.find_by_id(next(it)), len(ids))))
+
+    results.append(summarize(
+        "Order.iter_orders_export_rows",
+        timed(lambda: sum(1 for _ in Order.iter_orders_export_rows()), args.repeat),
+    ))
+    results.append(summarize(
+        "Order.iter_sales_report_rows",
+        timed(lambda: sum(1 for _ in Order.iter_sales_report_rows()), args.repeat),
+    ))
+    results += bench_startup(args)
+    return results
+
+
+def bench_startup(args):
+    # khởi động lạnh như api.startup: mặc định (products + history từ DB)
+    # so với INVENTORY_FAST_STARTUP (products từ snapshot, history nạp nền => không nằm trên đường khởi động)
+    snapshot = args.db + ".snapshot"
+    Product.load_from_db()
+    Product.save_snapshot(snapshot)
+
+    def from_db():
+        Product.clear_cache()
+        Order.orders_history.clear()
+        Order._version = None
+        init_db()
+        Product.load_from_db()
+        Order.load_history_from_db()
+
+    def from_snapshot():
+        Product.clear_cache()
+        init_db()
+        if not Product.load_snapshot(snapshot):
+            raise RuntimeError("snapshot rejected")
+
+    results = [
+        summarize("startup (db)", timed(from_db, args.repeat), products=args.products, orders=args.orders),
+        summarize("startup (snapshot, lazy history)", timed(from_snapshot, args.repeat),
+                  snapshot_bytes=os.path.getsize(snapshot)),
+    ]
+    os.remove(snapshot)
+    return results
+
+
+def bench_api(args):
+    try:
+        from fastapi.testclient import TestClient
+    except ImportError:
+        return [], {"skipped": "fastapi (and httpx) are required for the API benchmarks"}
+
+    import api
+
+    rng = random.Random(args.seed)
+    results = []
+    with TestClient(api.app) as client:
+        routes = [
+            ("GET /products", "/products"),
+            ("GET /products?limit=100", "/products?limit=100"),
+            ("GET /products?category", "/products?category=Category%207&fields=id,quantity"),
+            ("GET /products/{id}", lambda: f"/products/{rng.randint(1, args.products)}"),
+            ("GET /reports/revenue", "/reports/revenue"),
+            ("GET /reports/top-selling", "/reports/top-selling?limit=10"),
+            ("GET /ai/low-stock-forecast", "/ai/low-stock-forecast?threshold=100"),
+            ("GET /ai/reorder-suggest", "/ai/reorder-suggest"),
+            ("GET /exports/orders.csv", "/exports/orders.csv"),
+            ("GET /exports/sales-report.csv", "/exports/sales-report.csv"),
+        ]
+        for name, url in routes:
+            def call():
+                r = client.get(url() if callable(url) else url)
+                r.raise_for_status()
+                _ = r.content  # export: đọc hết body stream
+            results.append(summarize(name, timed(call, args.repeat)))
+
+        # ETag: poll lại khi kho chưa đổi => 304
+        etag = client.get("/products").headers.get("etag")
+        results.append(summarize(
+            "GET /products (304)",
+            timed(lambda: client.get("/products", headers={"If-None-Match": etag}), args.repeat),
+        ))
+
+        order_result, checks = bench_concurrent_orders(client, args, rng)
+        results.append(order_result)
+    return results, checks
+
+
+def bench_concurrent_orders(client, args, rng):
+    # nhiều request POST /orders song song, sau đó kiểm tra id không trùng + tồn kho được bảo toàn
+    with transaction(immediate=False) as cur:
+        stock_before = cur.execute("SELECT COALESCE(SUM(quantity), 0) FROM products").fetchone()[0]
+        orders_before = cur.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+
+    # vài SKU "hot" để có tranh chấp thật (hết hàng giữa chừng)
+    hot = list(range(1, min(args.products, 20) + 1))
+    payloads = [
+        {"customer": f"bench-{i}", "items": [
+            {"product_id": rng.choice(hot), "qty": rng.randint(1, 3)},
+            {"product_id": rng.randint(1, args.products), "qty": 1},
+        ]}
+        for i in range(args.requests)
+    ]
+
+    def post(payload):
+        t0 = time.perf_counter()
+        r = client.post("/orders", json=payload)
+        return time.perf_counter() - t0, r.status_code, r.json(), payload
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        responses = list(pool.map(post, payloads))
+    wall = time.perf_counter() - t0
+
+    ok = [(body, payload) for _, status, body, payload in responses if status == 200 and body.get("ok")]
+    ids = [body["order_id"] for body, _ in ok]
+    sold = sum(item["qty"] for _, payload in ok for item in payload["items"])
+
+    with transaction(immediate=False) as cur:
+        stock_after = cur.execute("SELECT COALESCE(SUM(quantity), 0) FROM products").fetchone()[0]
+        orders_after = cur.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+        negative = cur.execute("SELECT COUNT(*) FROM products WHERE quantity < 0").fetchone()[0]
+
+    checks = {
+        "orders_accepted": len(ok),
+        "orders_rejected": len(responses) - len(ok),
+        "unique_order_ids": len(ids) == len(set(ids)),
+        "orders_persisted": orders_after - orders_before == len(ok),
+        "stock_conserved": stock_before - stock_after == sold,
+        "no_negative_stock": negative == 0,
+    }
+    result = summarize(
+        f"POST /orders x{args.workers} threads",
+        [d for d, _, _, _ in responses],
+        wall_s=round(wall, 4),
+        wall_throughput_ops_s=round(len(responses) / wall, 2) if wall else None,
+    )
+    return result, checks
+
+
+def bench_orders(args):
+    # không cần FastAPI: nhiều thread gọi thẳng place_order_db trên DB tạm
+    # kiểm tra id không trùng, số đơn đã ghi, tồn kho được bảo toàn và không âm,
+    # và orders_history trong RAM khớp DB (writer xong không theo thứ tự không được chèn trùng)
+    seed_db(args.db, args.products, 0, seed=args.seed)
+    Order.load_history_from_db()
+    rng = random.Random(args.seed)
+    with transaction(immediate=False) as cur:
+        stock_before = cur.execute("SELECT COALESCE(SUM(quantity), 0) FROM products").fetchone()[0]
+
+    # vài SKU "hot" để có tranh chấp thật (hết hàng giữa chừng)
+    hot = list(range(1, min(args.products, 20) + 1))
+    requests = [
+        [(rng.choice(hot), rng.randint(1, 3)), (rng.randint(1, args.products), 1)]
+        for _ in range(args.requests)
+    ]
+
+    def place(items):
+        order = Order(None, [], customer_info="bench")
+        msg, total = order.place_order_db(items)
+        return order.order_id if total is not None else None, items
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        placed = list(pool.map(place, requests))
+    wall = time.perf_counter() - t0
+
+    ok = [(oid, items) for oid, items in placed if oid is not None]
+    ids = [oid for oid, _ in ok]
+    sold = sum(qty for _, items in ok for _, qty in items)
+
+    with transaction(immediate=False) as cur:
+        stock_after = cur.execute("SELECT COALESCE(SUM(quantity), 0) FROM products").fetchone()[0]
+        persisted = cur.execute("SELECT COUNT(*) FROM orders").fetchone()[0]
+        negative = cur.execute("SELECT COUNT(*) FROM products WHERE quantity < 0").fetchone()[0]
+        db_ids = [r[0] for r in cur.execute("SELECT order_id FROM orders ORDER BY order_id")]
+    history_ids = [o["order_id"] for o in Order.orders_history]
+    close_all_conns()
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "db": args.db,
+            "products": args.products,
+            "requests": args.requests,
+            "workers": args.workers,
+            "seed": args.seed,
+            "wall_s": round(wall, 4),
+            "throughput_ops_s": round(len(placed) / wall, 2) if wall else None,
+        },
+        "checks": {
+            "orders_accepted": len(ok),
+            "orders_rejected": len(placed) - len(ok),
+            "unique_order_ids": len(ids) == len(set(ids)),
+            "orders_persisted": persisted == len(ok),
+            "stock_conserved": stock_before - stock_after == sold,
+            "no_negative_stock": negative == 0,
+            "history_entries": len(history_ids),
+            "history_no_duplicates": len(history_ids) == len(set(history_ids)),
+            "history_matches_db": sorted(history_ids) == db_ids,
+        },
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    t0 = time.perf_counter()
+    seed_db(args.db, args.products, args.orders, args.lines, seed=args.seed)
+    seed_s = time.perf_counter() - t0
+
+    results = bench_core(args)
+    checks = {"skipped": "--skip-api"}
+    if not args.skip_api:
+        api_results, checks = bench_api(args)
+        results += api_results
+    close_all_conns()
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "timestamp": time.time(),
+            "db": args.db,
+            "products": args.products,
+            "orders": args.orders,
+            "lines_per_order": args.lines,
+            "repeat": args.repeat,
+            "seed": args.seed,
+            "seed_s": round(seed_s, 3),
+        },
+        "results": results,
+        "checks": checks,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inventory benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    r = sub.add_parser("run", help="seed a DB, measure core paths and API routes, print JSON")
+    r.add_argument("--db", default=DEFAULT_DB, help="benchmark DB file (recreated on every run)")
+    r.add_argument("--products", type=int, default=10_000)
+    r.add_argument("--orders", type=int, default=50_000)
+    r.add_argument("--lines", type=int, default=3, help="lines per seeded order")
+    r.add_argument("--repeat", type=int, default=20, help="runs per measurement")
+    r.add_argument("--lookups", type=int, default=100_000, help="find_by_id calls")
+    r.add_argument("--requests", type=int, default=2000, help="concurrent POST /orders requests")
+    r.add_argument("--workers", type=int, default=16, help="client threads for POST /orders")
+    r.add_argument("--seed", type=int, default=42)
+    r.add_argument("--skip-api", action="store_true", help="only core paths (no FastAPI needed)")
+    r.add_argument("-o", "--output", help="write JSON here instead of stdout")
+
+    o = sub.add_parser("orders", help="concurrent place_order_db on a temp DB, check ids and stock")
+    o.add_argument("--db", default=DEFAULT_DB, help="benchmark DB file (recreated on every run)")
+    o.add_argument("--products", type=int, default=200)
+    o.add_argument("--requests", type=int, default=5000, help="orders placed in total")
+    o.add_argument("--workers", type=int, default=32, help="threads placing orders")
+    o.add_argument("--seed", type=int, default=42)
+    o.add_argument("-o", "--output", help="write JSON here instead of stdout")
+
+    mem = sub.add_parser("memory", help="memory of the product cache per representation")
+    mem.add_argument("-n", "--products", type=int, default=100_000)
+
+    args = parser.parse_args(argv)
+    if args.command == "memory":
+        report = bench_memory(args.products)
+        output = None
+    elif args.command == "orders":
+        report = bench_orders(args)
+        output = args.output
+    else:
+        report = run(args)
+        output = args.output
+
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    # check concurrency fail => exit code khác 0 để CI bắt được
+    checks = report.get("checks", {})
+    return 1 if any(v is False for v in checks.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
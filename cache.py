@@ -0,0 +1,62 @@
+import threading
+import time
+
+from collections import OrderedDict
+
+from main import current_versions
+
+
+class ResponseCache:
+    # cache kết quả endpoint theo (endpoint, params)
+    # mỗi entry nhớ version dữ liệu lúc tính => DB đổi (version bump) là entry hết hiệu lực
+    # giới hạn số entry (LRU) + TTL cho phần phụ thuộc thời gian (cửa sổ "N ngày tới giờ")
+
+    def __init__(self, max_entries=256, ttl_seconds=60.0):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self._entries = OrderedDict()  # key -> (versions, expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_compute(self, endpoint, params, compute):
+        key = (endpoint, tuple(sorted(params.items())))
+        versions = current_versions()
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == versions and entry[1] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        # tính ngoài lock: request khác vẫn đọc được các entry còn lại
+        value = compute()
+
+        with self._lock:
+            self._entries[key] = (versions, now + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            }
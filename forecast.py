@@ -0,0 +1,149 @@
+import math
+import time
+
+from main import Product, transaction
+
+
+DAY = 86400
+HOUR = 3600
+MIN_WINDOW_DAYS = 1.0  # cửa sổ quá ngắn (vài phút) thì không ngoại suy ra cả ngày
+
+
+def window_start_for_orders(cur, lookback_orders):
+    # thời điểm của đơn thứ N gần nhất => cửa sổ thời gian tương đương "N đơn gần nhất"
+    if lookback_orders <= 0:
+        return 0.0
+    cur.execute("SELECT created_at FROM orders ORDER BY order_id DESC LIMIT 1 OFFSET ?", (lookback_orders - 1,))
+    row = cur.fetchone()
+    if row is None:
+        # bảng nóng ít hơn N đơn => phần còn lại nằm trong archive
+        cur.execute("SELECT COUNT(*) FROM orders")
+        offset = lookback_orders - 1 - cur.fetchone()[0]
+        cur.execute("SELECT created_at FROM orders_archive ORDER BY order_id DESC LIMIT 1 OFFSET ?", (offset,))
+        row = cur.fetchone()
+    # ít hơn N đơn, hoặc đơn cũ không có created_at => lấy toàn bộ
+    return (row[0] or 0.0) if row else 0.0
+
+
+def window_demand(cur, since):
+    # tổng units + số đơn có chứa sản phẩm, tính từ `since` tới giờ
+    # ngày trọn vẹn đọc bucket ngày, phần lẻ đầu cửa sổ đọc bucket giờ => không chạm order_items
+    # bucket giờ chứa `since` được đếm cả giờ: caller nên truyền since đã làm tròn về đầu giờ
+    first_full_day = math.ceil(since / DAY)
+    demand = {}  # pid -> [units, order_hits]
+
+    cur.execute("""
+        SELECT product_id, SUM(units), SUM(order_hits) FROM demand_buckets
+        WHERE granularity = 'day' AND bucket >= ?
+        GROUP BY product_id
+    """, (first_full_day,))
+    for pid, units, hits in cur.fetchall():
+        demand[pid] = [units, hits]
+
+    first_hour = int(since // HOUR)
+    if first_hour < first_full_day * 24:
+        cur.execute("""
+            SELECT product_id, SUM(units), SUM(order_hits) FROM demand_buckets
+            WHERE granularity = 'hour' AND bucket >= ? AND bucket < ?
+            GROUP BY product_id
+        """, (first_hour, first_full_day * 24))
+        for pid, units, hits in cur.fetchall():
+            d = demand.setdefault(pid, [0, 0])
+            d[0] += units
+            d[1] += hits
+
+    return demand
+
+
+def _resolve_window(cur, lookback_orders, lookback_days, now):
+    if lookback_days is not None and lookback_days > 0:
+        since = now - lookback_days * DAY
+    else:
+        since = window_start_for_orders(cur, lookback_orders)
+
+    start = since
+    if start <= 0:
+        # demand_buckets gồm cả đơn đã archive => mốc đầu tính trên cả 2 bảng
+        cur.execute("SELECT MIN(t) FROM (SELECT MIN(created_at) AS t FROM orders UNION ALL SELECT MIN(created_at) FROM orders_archive)")
+        start = cur.fetchone()[0] or now
+    if now - start < MIN_WINDOW_DAYS * DAY:
+        # cửa sổ quá ngắn => lùi since về đủ MIN_WINDOW_DAYS, để khoảng đếm units và số chia khớp nhau
+        since = start = now - MIN_WINDOW_DAYS * DAY
+    if since > 0:
+        # bucket giờ chứa since được đếm nguyên giờ => lùi since về đầu giờ đó, số chia cũng tính từ đó
+        since = start = since // HOUR * HOUR
+    return since, (now - start) / DAY
+
+
+def low_stock_forecast(lookback_orders=10, threshold=2, lookback_days=None):
+    now = time.time()
+    with transaction(immediate=False) as cur:
+        since, window_days = _resolve_window(cur, lookback_orders, lookback_days, now)
+        demand = window_demand(cur, since)
+
+    results = []
+    for p in Product.inventory:
+        if p.quantity <= threshold:
+            pid = p.product_id
+            total_sold, hits = demand.get(pid, (0, 0))
+
+            # avg qty per order (chỉ tính những đơn có món đó)
+            avg_per_order = (total_sold / hits) if hits > 0 else 0
+            daily_demand = total_sold / window_days
+
+            # dự đoán còn bao nhiêu đơn / bao nhiêu ngày nữa hết
+            est_orders_left = (p.quantity / avg_per_order) if avg_per_order > 0 else None
+            days_of_cover = (p.quantity / daily_demand) if daily_demand > 0 else None
+
+            results.append({
+                "product_id": pid,
+                "product_name": p.name,
+                "qty_left": p.quantity,
+                "lookback_orders": lookback_orders,
+                "window_days": round(window_days, 2),
+                "avg_sold_per_order": round(avg_per_order, 2),
+                "estimated_orders_left": (round(est_orders_left, 2) if est_orders_left is not None else None),
+                "days_of_cover": (round(days_of_cover, 2) if days_of_cover is not None else None),
+                "note": ("not enough data" if avg_per_order == 0 else "ok")
+            })
+
+    return {
+        "threshold": threshold,
+        "results": results
+    }
+
+
+def reorder_suggest(lookback_orders=20, target_days=7, lookback_days=None):
+    now = time.time()
+    with transaction(immediate=False) as cur:
+        since, window_days = _resolve_window(cur, lookback_orders, lookback_days, now)
+        demand = window_demand(cur, since)
+
+    results = []
+    for p in Product.inventory:
+        pid = p.product_id
+        total_sold = demand.get(pid, (0, 0))[0]
+
+        # nhu cầu/ngày thật từ timestamp đơn (không còn giả lập 1 đơn/ngày)
+        daily_demand = total_sold / window_days
+        days_of_cover = (p.quantity / daily_demand) if daily_demand > 0 else None
+
+        need_for_days = daily_demand * target_days
+        reorder_qty = max(0, int(round(need_for_days - p.quantity)))
+
+        results.append({
+            "product_id": pid,
+            "product_name": p.name,
+            "qty_left": p.quantity,
+            "lookback_orders": lookback_orders,
+            "window_days": round(window_days, 2),
+            "target_days": target_days,
+            "estimated_daily_demand": round(daily_demand, 2),
+            "days_of_cover": (round(days_of_cover, 2) if days_of_cover is not None else None),
+            "recommended_reorder_qty": reorder_qty
+        })
+
+    # ưu tiên món cần nhập nhiều nhất lên đầu
+    results.sort(key=lambda x: x["recommended_reorder_qty"], reverse=True)
+
+    return {"results": results}
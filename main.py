@@ -1,19 +1,122 @@
+import argparse
 import csv
+import hashlib
+import io
+import json
+import marshal
+import os
+import secrets
 import sqlite3
+import sys
+import threading
+import time
 
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from contextlib import contextmanager
 from dataclasses import dataclass
-from typing import ClassVar, List, Optional, Tuple
+from itertools import groupby
+from operator import attrgetter, itemgetter
+from typing import ClassVar, Dict, List, Optional, Tuple
 
+import metrics
 
-DB_FILE = "inventory.db"
 
+DB_FILE = "inventory.db"
+BUSY_TIMEOUT_MS = 5000
+STATEMENT_CACHE_SIZE = 256
+BULK_CHUNK_SIZE = 1000
+HOLD_TTL_SECONDS = 900     # reservation mặc định giữ hàng 15 phút
+MAX_HOLD_TTL_SECONDS = 86400  # giữ hàng lâu hơn 1 ngày => coi như khoá kho, không cho
+SWEEP_BATCH_SIZE = 500     # số reservation hết hạn xử lý mỗi transaction
+ARCHIVE_BATCH_SIZE = 2000  # số đơn chuyển sang archive mỗi transaction
+ORDER_BATCH_CHUNK_SIZE = 100  # số đơn mỗi transaction khi ghi 1 batch lớn (place_batch_db)
+PARTIAL_STOCK_POLICIES = ("reject", "fill")  # thiếu hàng: từ chối cả đơn / bán phần còn lại
+IDEMPOTENCY_TTL_SECONDS = 86400  # Idempotency-Key được nhớ 24h
+IDEMPOTENCY_CONFLICT = "Idempotency-Key was already used for a different request."
+MAX_REPORTED_ERRORS = 1000
+SNAPSHOT_MAGIC = b"INVSNAP1"  # đổi khi đổi format file snapshot
+CHANGE_LOG_RETENTION_SECONDS = 7 * 86400  # change_log giữ 7 ngày; consumer chậm hơn thế phải lấy lại snapshot
+CHANGE_FEED_BATCH_SIZE = 1000
+SYNC_FULL_RELOAD_RATIO = 0.25  # số dòng đổi > tỉ lệ này của cache => reload full rẻ hơn đọc từng dòng
+
+# pool: mỗi thread giữ 1 connection dùng lại (FastAPI chạy route sync trên threadpool)
+_local = threading.local()
+_pool_lock = threading.Lock()
+_pool = []             # mọi connection đã mở, để close_all_conns() đóng hết
+_pool_generation = 0   # tăng khi đóng pool => thread tự mở lại connection mới
+
+def _open_conn():
+    # autocommit (isolation_level=None): transaction luôn mở tường minh bằng BEGIN
+    conn = sqlite3.connect(
+        DB_FILE,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        isolation_level=None,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        factory=metrics.connection_factory(),
+    )
+    metrics.connection_opened()
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    return conn
+
+def _thread_conn():
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.path != DB_FILE or _local.generation != _pool_generation:
+        conn = _open_conn()
+        with _pool_lock:
+            _pool.append(conn)
+            _local.generation = _pool_generation
+        _local.conn = conn
+        _local.path = DB_FILE
+        _local.depth = 0
+    return conn
+
+@contextmanager
 def get_conn():
-    return sqlite3.connect(DB_FILE)
+    # with get_conn() as conn: ... (không tự close, connection được trả lại cho thread)
+    conn = _thread_conn()
+    _local.depth += 1
+    try:
+        yield conn
+    finally:
+        _local.depth -= 1
+        # lớp ngoài cùng: không để transaction dở dang lại cho lần dùng sau
+        if _local.depth == 0 and conn.in_transaction:
+            conn.rollback()
+
+@contextmanager
+def transaction(immediate=True):
+    # BEGIN IMMEDIATE cho ghi (lấy write lock ngay), BEGIN thường cho đọc snapshot
+    # gọi lồng trong 1 transaction đang mở thì dùng chung transaction đó
+    with get_conn() as conn:
+        if conn.in_transaction:
+            yield conn.cursor()
+            return
+
+        conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        try:
+            yield conn.cursor()
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+def close_all_conns():
+    global _pool_generation
+    with _pool_lock:
+        for conn in _pool:
+            conn.close()
+        _pool.clear()
+        _pool_generation += 1
 
 def init_db():
-    conn = get_conn()
-    cur = conn.cursor()
+    with transaction() as cur:
+        _create_schema(cur)
 
+def _create_schema(cur):
     # bảng products
     cur.execute("""
     CREATE TABLE IF NOT EXISTS products (
@@ -22,17 +125,60 @@ def init_db():
         category TEXT NOT NULL,
         quantity INTEGER NOT NULL,
         price REAL NOT NULL,
-        supplier TEXT NOT NULL
+        supplier TEXT NOT NULL,
+        reserved INTEGER NOT NULL DEFAULT 0
     )
     """)
+    # reserved = số lượng đang bị giữ bởi reservation còn hạn (available = quantity - reserved)
+    _add_column_if_missing(cur, "products", "reserved", "INTEGER NOT NULL DEFAULT 0")
+
+    # giữ hàng có hạn cho checkout nhiều bước (hết hạn => sweeper trả lại hàng)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS reservations (
+        hold_id INTEGER PRIMARY KEY,
+        customer TEXT,
+        created_at REAL NOT NULL,
+        expires_at REAL NOT NULL
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_reservations_expires_at ON reservations(expires_at)")
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS reservation_items (
+        hold_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        qty INTEGER NOT NULL,
+        PRIMARY KEY (hold_id, product_id)
+    )
+    """)
+
+    # Idempotency-Key -> kết quả đơn (ghi cùng transaction với đơn) để retry không tạo đơn thứ 2
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS idempotency_keys (
+        key TEXT PRIMARY KEY,
+        request_hash TEXT NOT NULL,
+        order_id INTEGER,
+        message TEXT NOT NULL,
+        total REAL,
+        created_at REAL NOT NULL
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created_at ON idempotency_keys(created_at)")
 
     # bảng orders
     cur.execute("""
     CREATE TABLE IF NOT EXISTS orders (
         order_id INTEGER PRIMARY KEY,
-        customer TEXT
+        customer TEXT,
+        created_at REAL,
+        total REAL
     )
     """)
+    # DB cũ chưa có cột created_at (đơn cũ để NULL: không biết thời điểm)
+    _add_column_if_missing(cur, "orders", "created_at", "REAL")
+    # tổng tiền lưu sẵn theo giá lúc bán; DB cũ => tính 1 lần từ order_items
+    if _add_column_if_missing(cur, "orders", "total", "REAL"):
+        backfill_order_totals(cur)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders(created_at)")
 
     # bảng order_items
     cur.execute("""
@@ -47,11 +193,269 @@ def init_db():
     )
     """)
 
-    conn.commit()
-    conn.close()
+    # index cho join orders <-> order_items (tránh full scan mỗi đơn)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_order_items_order_id ON order_items(order_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_order_items_product_id ON order_items(product_id)")
 
+    # đơn cũ chuyển sang bảng archive (Order.archive_db): bảng nóng + orders_history chỉ còn cửa sổ gần đây
+    # số liệu cộng dồn (product_sales, sales_totals, demand_buckets) vẫn tính cả đơn đã archive
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS orders_archive (
+        order_id INTEGER PRIMARY KEY,
+        customer TEXT,
+        created_at REAL,
+        total REAL,
+        archived_at REAL NOT NULL
+    )
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS order_items_archive (
+        id INTEGER PRIMARY KEY,
+        order_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        qty INTEGER NOT NULL,
+        unit_price REAL NOT NULL
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_order_items_archive_order_id ON order_items_archive(order_id)")
+    # toàn bộ đơn (nóng + archive), cho các chỗ cần tính lại từ đầu
+    cur.execute("""
+    CREATE VIEW IF NOT EXISTS all_orders AS
+        SELECT order_id, customer, created_at, total FROM orders
+        UNION ALL
+        SELECT order_id, customer, created_at, total FROM orders_archive
+    """)
+    cur.execute("""
+    CREATE VIEW IF NOT EXISTS all_order_items AS
+        SELECT id, order_id, product_id, qty, unit_price FROM order_items
+        UNION ALL
+        SELECT id, order_id, product_id, qty, unit_price FROM order_items_archive
+    """)
 
-@dataclass
+    # version của từng nhóm dữ liệu, tăng mỗi lần ghi (để cache biết khi nào cần reload)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS data_versions (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL
+    )
+    """)
+    cur.executemany(
+        "INSERT OR IGNORE INTO data_versions (name, version) VALUES (?, 0)",
+        [("products",), ("orders",), ("orders_archive",), ("change_log_floor",)]
+    )
+    # id ngẫu nhiên của file DB: snapshot chụp từ DB khác (restore, copy) thì không dùng
+    cur.execute(
+        "INSERT OR IGNORE INTO data_versions (name, version) VALUES ('db_instance', ?)",
+        (secrets.randbits(62),)
+    )
+
+    # nhật ký thay đổi: mỗi lần ghi thêm (entity, id) cùng transaction, seq tăng dần không dùng lại
+    # => worker/process khác chỉ đọc lại đúng các dòng đổi từ seq nó đã thấy
+    # change_log_floor = seq lớn nhất đã bị dọn (cache thấy seq cũ hơn mốc này phải reload full)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS change_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        entity TEXT NOT NULL,
+        entity_id INTEGER NOT NULL,
+        op TEXT NOT NULL,
+        created_at REAL NOT NULL
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_change_log_entity_seq ON change_log(entity, seq)")
+    # tìm bản ghi mới hơn của cùng entity (feed bỏ bản cũ, compaction xoá bản cũ)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_change_log_entity_id ON change_log(entity, entity_id, seq)")
+
+    # số liệu bán hàng cộng dồn (cập nhật cùng transaction với mỗi đơn)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS product_sales (
+        product_id INTEGER PRIMARY KEY,
+        units_sold INTEGER NOT NULL,
+        revenue REAL NOT NULL,
+        order_hits INTEGER NOT NULL
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_product_sales_units ON product_sales(units_sold)")
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS sales_totals (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        revenue REAL NOT NULL,
+        order_count INTEGER NOT NULL
+    )
+    """)
+    # nhu cầu theo khung giờ/ngày cho forecast (bucket = unix time // 3600 hoặc // 86400)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS demand_buckets (
+        granularity TEXT NOT NULL,
+        bucket INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        units INTEGER NOT NULL,
+        order_hits INTEGER NOT NULL,
+        PRIMARY KEY (granularity, bucket, product_id)
+    )
+    """)
+
+    cur.execute("INSERT OR IGNORE INTO sales_totals (id, revenue, order_count) VALUES (1, 0, 0)")
+    if cur.rowcount:
+        # DB cũ đã có đơn từ trước => tính lại 1 lần từ order_items
+        rebuild_sales_aggregates(cur)
+
+def _add_column_if_missing(cur, table, column, decl):
+    cur.execute(f"PRAGMA table_info({table})")
+    if column not in {row[1] for row in cur.fetchall()}:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+        return True
+    return False
+
+def backfill_order_totals(cur):
+    # migration: orders.total = tổng qty * unit_price (giá đã lưu lúc bán) của các dòng
+    cur.execute("""
+        UPDATE orders SET total = (
+            SELECT COALESCE(SUM(i.qty * i.unit_price), 0) FROM order_items i WHERE i.order_id = orders.order_id
+        )
+        WHERE total IS NULL
+    """)
+    return cur.rowcount
+
+BUCKET_SECONDS = {"hour": 3600, "day": 86400}
+
+def rebuild_sales_aggregates(cur):
+    cur.execute("DELETE FROM product_sales")
+    cur.execute("""
+        INSERT INTO product_sales (product_id, units_sold, revenue, order_hits)
+        SELECT product_id, SUM(qty), SUM(qty * unit_price), COUNT(DISTINCT order_id)
+        FROM all_order_items
+        GROUP BY product_id
+    """)
+    cur.execute("""
+        UPDATE sales_totals SET
+            revenue = (SELECT COALESCE(SUM(qty * unit_price), 0) FROM all_order_items),
+            order_count = (SELECT COUNT(*) FROM all_orders)
+        WHERE id = 1
+    """)
+
+    # bucket nhu cầu: chỉ tính được cho đơn có created_at
+    cur.execute("DELETE FROM demand_buckets")
+    # đơn và item luôn archive cùng lúc => join từng cặp bảng (dùng được index), cộng dồn vào bucket
+    for items_table, orders_table in (("order_items", "orders"), ("order_items_archive", "orders_archive")):
+        for granularity, seconds in BUCKET_SECONDS.items():
+            cur.execute(f"""
+                INSERT INTO demand_buckets (granularity, bucket, product_id, units, order_hits)
+                SELECT ?, CAST(o.created_at / ? AS INTEGER) AS b, i.product_id, SUM(i.qty), COUNT(DISTINCT i.order_id)
+                FROM {items_table} i
+                JOIN {orders_table} o ON o.order_id = i.order_id
+                WHERE o.created_at IS NOT NULL
+                GROUP BY b, i.product_id
+                ON CONFLICT(granularity, bucket, product_id) DO UPDATE SET
+                    units = units + excluded.units,
+                    order_hits = order_hits + excluded.order_hits
+            """, (granularity, seconds))
+
+def record_sale(cur, lines, created_at=None):
+    # lines: [(product_id, qty, unit_price)] của 1 đơn, gọi trong transaction ghi đơn
+    per_product = {}
+    for pid, qty, price in lines:
+        units, revenue = per_product.get(pid, (0, 0))
+        per_product[pid] = (units + qty, revenue + qty * price)
+
+    cur.executemany("""
+        INSERT INTO product_sales (product_id, units_sold, revenue, order_hits)
+        VALUES (?, ?, ?, 1)
+        ON CONFLICT(product_id) DO UPDATE SET
+            units_sold = units_sold + excluded.units_sold,
+            revenue = revenue + excluded.revenue,
+            order_hits = order_hits + 1
+    """, [(pid, units, revenue) for pid, (units, revenue) in per_product.items()])
+    cur.execute(
+        "UPDATE sales_totals SET revenue = revenue + ?, order_count = order_count + 1 WHERE id = 1",
+        (sum(revenue for _, revenue in per_product.values()),)
+    )
+
+    if created_at is None:
+        return
+    # cộng vào bucket giờ + ngày của thời điểm đặt đơn
+    cur.executemany("""
+        INSERT INTO demand_buckets (granularity, bucket, product_id, units, order_hits)
+        VALUES (?, ?, ?, ?, 1)
+        ON CONFLICT(granularity, bucket, product_id) DO UPDATE SET
+            units = units + excluded.units,
+            order_hits = order_hits + 1
+    """, [
+        (granularity, int(created_at // seconds), pid, units)
+        for granularity, seconds in BUCKET_SECONDS.items()
+        for pid, (units, _) in per_product.items()
+    ])
+
+def read_version(cur, name):
+    cur.execute("SELECT version FROM data_versions WHERE name = ?", (name,))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+def bump_version(cur, name):
+    # gọi bên trong transaction ghi
+    cur.execute("UPDATE data_versions SET version = version + 1 WHERE name = ?", (name,))
+    return read_version(cur, name)
+
+def log_changes(cur, entity, changes):
+    # changes: [(entity_id, op)]; gọi trong transaction ghi => commit/rollback cùng thay đổi
+    now = time.time()
+    cur.executemany(
+        "INSERT INTO change_log (entity, entity_id, op, created_at) VALUES (?, ?, ?, ?)",
+        [(entity, entity_id, op, now) for entity_id, op in changes]
+    )
+
+def read_change_seq(cur):
+    # seq lớn nhất đã cấp (sqlite_sequence vẫn giữ dù dòng đã bị dọn)
+    cur.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'")
+    row = cur.fetchone()
+    return row[0] if row else 0
+
+def changed_ids(cur, entity, since_seq):
+    # id đã đổi sau since_seq; None = nhật ký đã bị dọn qua mốc đó => phải reload full
+    if since_seq < read_version(cur, "change_log_floor"):
+        return None
+    cur.execute(
+        "SELECT DISTINCT entity_id FROM change_log WHERE entity = ? AND seq > ?",
+        (entity, since_seq)
+    )
+    return [r[0] for r in cur.fetchall()]
+
+class ChangeLogExpired(Exception):
+    # cursor since đã bị compaction dọn qua => consumer phải lấy lại snapshot đầy đủ
+    pass
+
+def current_version(name):
+    with get_conn() as conn:
+        return read_version(conn.cursor(), name)
+
+def current_versions():
+    # {name: version} của mọi bảng, 1 query (dùng làm khoá cache cho kết quả tính từ nhiều bảng)
+    with get_conn() as conn:
+        return dict(conn.execute("SELECT name, version FROM data_versions").fetchall())
+
+
+_product_key = attrgetter("product_id")
+
+def _dictionary_encode(values):
+    # cột string lặp nhiều (category, supplier) => (list giá trị khác nhau, array mã theo từng dòng)
+    index = {}
+    codes = array("I", (index.setdefault(v, len(index)) for v in values))
+    return list(index), codes
+
+def _insert_sorted(items, p):
+    # danh sách luôn sắp theo product_id => thêm cuối là O(1) trong trường hợp thường gặp
+    if not items or items[-1].product_id < p.product_id:
+        items.append(p)
+    else:
+        insort(items, p, key=_product_key)
+
+def _remove_sorted(items, p):
+    i = bisect_left(items, p.product_id, key=_product_key)
+    if i < len(items) and items[i] is p:
+        del items[i]
+
+
+# slots: không có __dict__ mỗi object => catalog lớn (hàng triệu SKU) tốn ít RAM hơn hẳn
+@dataclass(slots=True)
 class Product:
     product_id: int
     name: str
@@ -59,8 +463,18 @@ class Product:
     quantity: int
     price: float
     supplier: str
-
-    inventory: ClassVar[List["Product"]] = []
+    reserved: int = 0  # đang bị giữ bởi reservation (chưa bán)
+
+    inventory: ClassVar[List["Product"]] = []  # luôn sắp theo product_id
+    # index: id -> product, category/supplier -> list product (sắp theo product_id)
+    _by_id: ClassVar[Dict[int, "Product"]] = {}
+    _by_category: ClassVar[Dict[str, List["Product"]]] = {}
+    _by_supplier: ClassVar[Dict[str, List["Product"]]] = {}
+    _version: ClassVar[Optional[int]] = None  # version của bảng products mà cache đang phản ánh
+    _seq: ClassVar[int] = 0  # seq change_log mà cache đã áp tới
+    # mọi thay đổi cache (load/sync/delta) đi qua lock này: threadpool FastAPI + writer cùng áp delta
+    # thì 2 thread không thể cùng tạo 1 SKU mới (trùng trong inventory/index)
+    _lock: ClassVar = threading.RLock()
 
     def __post_init__(self):
         # kiểm tra dữ liệu cơ bản
@@ -68,7 +482,55 @@ class Product:
             raise ValueError("quantity cannot be negative")
         if self.price < 0:
             raise ValueError("price cannot be negative")
-        Product.inventory.append(self)
+        if self.reserved < 0:
+            raise ValueError("reserved cannot be negative")
+        # category/supplier lặp lại rất nhiều => intern để mọi product dùng chung 1 string
+        self.category = sys.intern(self.category)
+        self.supplier = sys.intern(self.supplier)
+        Product._register(self)
+
+    @property
+    def available(self):
+        # available-to-promise: còn bán/giữ thêm được bao nhiêu
+        return self.quantity - self.reserved
+
+    @classmethod
+    def _register(cls, p):
+        _insert_sorted(cls.inventory, p)
+        cls._by_id[p.product_id] = p
+        _insert_sorted(cls._by_category.setdefault(p.category, []), p)
+        _insert_sorted(cls._by_supplier.setdefault(p.supplier, []), p)
+
+    @classmethod
+    def _unregister(cls, p):
+        _remove_sorted(cls.inventory, p)
+        if cls._by_id.get(p.product_id) is p:
+            del cls._by_id[p.product_id]
+        for index, key in ((cls._by_category, p.category), (cls._by_supplier, p.supplier)):
+            items = index.get(key)
+            if items is not None:
+                _remove_sorted(items, p)
+                if not items:
+                    del index[key]
+
+    @classmethod
+    def _reindex(cls, p, category, supplier):
+        # đổi category/supplier phải đi qua đây để index không bị lệch
+        if p.category == category and p.supplier == supplier:
+            return
+        cls._unregister(p)
+        p.category = sys.intern(category)
+        p.supplier = sys.intern(supplier)
+        cls._register(p)
+
+    @classmethod
+    def clear_cache(cls):
+        with cls._lock:
+            cls.inventory.clear()
+            cls._by_id.clear()
+            cls._by_category.clear()
+            cls._by_supplier.clear()
+            cls._version = None
 
     @classmethod
     def add_product(cls, name, category, quantity, price, supplier):
@@ -78,35 +540,281 @@ class Product:
 
     @classmethod
     def find_by_id(cls, product_id: int) -> Optional["Product"]:
-        for p in cls.inventory:
-            if p.product_id == product_id:
-                return p
-        return None
+        return cls._by_id.get(product_id)
+
+    @classmethod
+    def find_by_category(cls, category: str) -> List["Product"]:
+        return list(cls._by_category.get(category, ()))
+
+    @classmethod
+    def find_by_supplier(cls, supplier: str) -> List["Product"]:
+        return list(cls._by_supplier.get(supplier, ()))
+
+    @classmethod
+    def filter_products(cls, category=None, supplier=None) -> List["Product"]:
+        # dùng index nhỏ hơn rồi lọc tiếp theo điều kiện còn lại
+        if category is None and supplier is None:
+            return list(cls.inventory)
+        if category is None:
+            return cls.find_by_supplier(supplier)
+        if supplier is None:
+            return cls.find_by_category(category)
+
+        by_cat = cls._by_category.get(category, ())
+        by_sup = cls._by_supplier.get(supplier, ())
+        if len(by_cat) <= len(by_sup):
+            return [p for p in by_cat if p.supplier == supplier]
+        return [p for p in by_sup if p.category == category]
+
+    @classmethod
+    def page(cls, after_id=None, limit=None, category=None, supplier=None, min_qty=None, max_qty=None):
+        # keyset pagination: list (inventory hoặc index) đã sắp theo product_id
+        # => bisect tới sau after_id rồi đi tiếp, không đếm lại từ đầu như OFFSET
+        # trả về (items, next_after_id); next_after_id = None khi hết
+        if category is not None and supplier is not None:
+            by_cat = cls._by_category.get(category, ())
+            by_sup = cls._by_supplier.get(supplier, ())
+            if len(by_cat) <= len(by_sup):
+                base, extra = by_cat, lambda p: p.supplier == supplier
+            else:
+                base, extra = by_sup, lambda p: p.category == category
+        else:
+            if category is not None:
+                base = cls._by_category.get(category, ())
+            elif supplier is not None:
+                base = cls._by_supplier.get(supplier, ())
+            else:
+                base = cls.inventory
+            extra = None
+
+        if limit is not None and limit <= 0:
+            return [], after_id
+        start = 0 if after_id is None else bisect_right(base, after_id, key=_product_key)
+        items = []
+        for i in range(start, len(base)):
+            p = base[i]
+            if extra is not None and not extra(p):
+                continue
+            if min_qty is not None and p.quantity < min_qty:
+                continue
+            if max_qty is not None and p.quantity > max_qty:
+                continue
+            if limit is not None and len(items) == limit:
+                # còn ít nhất 1 item nữa => trang sau bắt đầu sau item cuối của trang này
+                return items, items[-1].product_id
+            items.append(p)
+        return items, None
 
     @classmethod
     def load_from_db(cls):
-        cls.inventory.clear()
-        conn = get_conn()
-        cur = conn.cursor()
-        cur.execute("SELECT product_id, name, category, quantity, price, supplier FROM products ORDER BY product_id")
-        rows = cur.fetchall()
-        conn.close()
+        # đọc version + dữ liệu trong cùng 1 snapshot, duyệt cursor thay vì fetchall
+        # (không giữ cùng lúc cả list tuple lẫn list object)
+        with cls._lock:
+            with transaction(immediate=False) as cur:
+                version = read_version(cur, "products")
+                seq = read_change_seq(cur)
+                cur.execute("SELECT product_id, name, category, quantity, price, supplier, reserved FROM products ORDER BY product_id")
+                if not cls._by_id:
+                    for r in cur:
+                        # tạo object và auto append vào inventory nhờ __post_init__
+                        cls(r[0], r[1], r[2], r[3], r[4], r[5], r[6])
+                else:
+                    cls._reload_rows(cur)
+            cls._version = version
+            cls._seq = seq
+            metrics.add_rows(len(cls.inventory))
+
+    @classmethod
+    def save_snapshot(cls, path):
+        # ghi cache ra file nhị phân dạng cột (marshal + array), kèm version/seq mà cache phản ánh
+        # đọc version/seq TRƯỚC khi chụp dòng: dòng có thể mới hơn version, không bao giờ cũ hơn
+        # => lúc nạp bù từ change_log vẫn ra đúng trạng thái
+        version, seq = cls._version, cls._seq
+        if version is None:
+            return False
+        with get_conn() as conn:
+            db_instance = read_version(conn.cursor(), "db_instance")
+
+        items = list(cls.inventory)
+        categories, category_codes = _dictionary_encode(p.category for p in items)
+        suppliers, supplier_codes = _dictionary_encode(p.supplier for p in items)
+        payload = (
+            db_instance, version, seq,
+            array("q", [p.product_id for p in items]).tobytes(),
+            [p.name for p in items],
+            categories, category_codes.tobytes(),
+            array("q", [p.quantity for p in items]).tobytes(),
+            array("d", [p.price for p in items]).tobytes(),
+            suppliers, supplier_codes.tobytes(),
+            array("q", [p.reserved for p in items]).tobytes(),
+        )
+        # ghi file tạm rồi rename => worker khác không bao giờ đọc phải file ghi dở
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(SNAPSHOT_MAGIC + marshal.dumps(payload))
+        os.replace(tmp, path)
+        return True
+
+    @classmethod
+    def load_snapshot(cls, path):
+        # True => cache đã nạp từ snapshot và bù xong phần đổi sau đó; False => caller tự load_from_db
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            if not data.startswith(SNAPSHOT_MAGIC):
+                return False
+            # loads trên cả buffer nhanh hơn marshal.load(file) nhiều (load đọc file từng mẩu nhỏ)
+            (db_instance, version, seq, ids, names, categories, category_codes,
+             quantities, prices, suppliers, supplier_codes, reserved) = marshal.loads(memoryview(data)[len(SNAPSHOT_MAGIC):])
+        except (OSError, EOFError, ValueError, TypeError):
+            return False
+
+        with transaction(immediate=False) as cur:
+            valid = (
+                db_instance == read_version(cur, "db_instance")
+                and version <= read_version(cur, "products")
+                and read_version(cur, "change_log_floor") <= seq <= read_change_seq(cur)
+            )
+        if not valid:
+            return False
+
+        columns = [array("q", ids), names, array("I", category_codes), array("q", quantities),
+                   array("d", prices), array("I", supplier_codes), array("q", reserved)]
+        if len({len(c) for c in columns}) != 1:
+            return False
+        categories = [sys.intern(c) for c in categories]
+        suppliers = [sys.intern(s) for s in suppliers]
+
+        with cls._lock:
+            cls.clear_cache()
+            new = cls.__new__
+            by_category, by_supplier = cls._by_category, cls._by_supplier
+            # dữ liệu đã qua kiểm tra lúc ghi DB, id đã sắp => dựng object + index thẳng, không bisect
+            for pid, name, c, qty, price, s, res in zip(*columns):
+                p = new(cls)
+                p.product_id, p.name, p.quantity, p.price, p.reserved = pid, name, qty, price, res
+                p.category, p.supplier = categories[c], suppliers[s]
+                cls.inventory.append(p)
+                cls._by_id[pid] = p
+                by_category.setdefault(p.category, []).append(p)
+                by_supplier.setdefault(p.supplier, []).append(p)
+            cls._version = version
+            cls._seq = seq
+            # snapshot cũ hơn DB => chỉ đọc lại các dòng đổi sau seq của snapshot
+            cls.refresh_from_db()
+        return True
+
+    @classmethod
+    def _reload_rows(cls, rows):
+        # reload khi cache đã có dữ liệu: sửa tại chỗ object cũ, chỉ tạo object cho SKU mới
+        # => không cấp phát lại cả catalog mỗi lần reload
+        with cls._lock:
+            stale = dict(cls._by_id)
+            for r in rows:
+                p = stale.pop(r[0], None)
+                if p is None:
+                    cls(r[0], r[1], r[2], r[3], r[4], r[5], r[6])
+                    continue
+                p.name, p.quantity, p.price, p.reserved = r[1], r[3], r[4], r[6]
+                cls._reindex(p, r[2], r[5])
+            for p in stale.values():
+                cls._unregister(p)
+
+    @classmethod
+    def refresh_from_db(cls):
+        # chỉ đọc DB khi version đã đổi so với cache (1 query nhỏ thay vì SELECT cả bảng)
+        if cls._version is None:
+            cls.load_from_db()
+        elif current_version("products") != cls._version:
+            cls._sync_from_log()
+
+    @classmethod
+    def _sync_from_log(cls):
+        # process/worker khác đã ghi: đọc change_log từ seq đã thấy, chỉ lấy lại các dòng đó
+        # giữ lock suốt từ lúc đọc _seq tới lúc gán _version/_seq: 2 thread refresh cùng lúc
+        # không thể áp rows cũ đè lên rows mới hơn hay kéo _seq lùi lại
+        with cls._lock:
+            if cls._version is None:
+                cls.load_from_db()
+                return
+            with transaction(immediate=False) as cur:
+                version = read_version(cur, "products")
+                # thread khác đã sync xong trong lúc chờ lock => không còn gì để đọc
+                if version == cls._version:
+                    return
+                seq = read_change_seq(cur)
+                ids = changed_ids(cur, "product", cls._seq)
+                full = ids is None or len(ids) > max(64, len(cls.inventory) * SYNC_FULL_RELOAD_RATIO)
+                rows = None if full else cls._fetch_rows(cur, ids)
+            if full:
+                cls.load_from_db()
+                return
+            cls._apply_rows(rows)
+            cls._version = version
+            cls._seq = seq
+
+    @staticmethod
+    def _fetch_rows(cur, product_ids):
+        # {product_id: row}; row None = đã bị xoá
+        rows = dict.fromkeys(product_ids)
+        if product_ids:
+            cur.execute(
+                "SELECT product_id, name, category, quantity, price, supplier, reserved FROM products "
+                "WHERE product_id IN (SELECT value FROM json_each(?))",
+                (json.dumps(product_ids),)
+            )
+            for r in cur.fetchall():
+                rows[r[0]] = r
+        return rows
+
+    @classmethod
+    def _apply_db_changes(cls, cur, before, product_ids):
+        # gọi trong transaction ghi, sau khi đã sửa bảng products
+        # trả về delta để áp vào cache sau khi commit
+        after = bump_version(cur, "products")
+        rows = cls._fetch_rows(cur, list(dict.fromkeys(product_ids)))
+        log_changes(cur, "product", [(pid, "upsert" if r else "delete") for pid, r in rows.items()])
+        return before, after, rows, read_change_seq(cur)
+
+    @classmethod
+    def _apply_delta(cls, delta):
+        before, after, rows, seq = delta
+        with cls._lock:
+            # thread khác đã đưa cache tới (hoặc qua) trạng thái này => delta đã nằm trong cache
+            if cls._version is not None and cls._version >= after:
+                return
+            # cache đã lệch từ trước (process khác ghi) => bù phần còn thiếu từ change_log
+            if before != cls._version:
+                cls._sync_from_log()
+                return
+            cls._apply_rows(rows)
+            cls._version = after
+            cls._seq = seq
 
-        for r in rows:
-            # tạo object và auto append vào inventory nhờ __post_init__
-            cls(r[0], r[1], r[2], r[3], r[4], r[5])
+    @classmethod
+    def _apply_rows(cls, rows):
+        with cls._lock:
+            for pid, r in rows.items():
+                p = cls.find_by_id(pid)
+                if r is None:
+                    if p:
+                        cls._unregister(p)
+                elif p:
+                    p.name, p.quantity, p.price, p.reserved = r[1], r[3], r[4], r[6]
+                    cls._reindex(p, r[2], r[5])
+                else:
+                    cls(r[0], r[1], r[2], r[3], r[4], r[5], r[6])
 
     @classmethod
     def add_product_db(cls, name, category, quantity, price, supplier):
-        conn = get_conn()
-        cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO products (name, category, quantity, price, supplier) VALUES (?, ?, ?, ?, ?)",
-            (name, category, quantity, price, supplier),
-        )
-        conn.commit()
-        conn.close()
-        cls.load_from_db()
+        with transaction() as cur:
+            before = read_version(cur, "products")
+            cur.execute(
+                "INSERT INTO products (name, category, quantity, price, supplier) VALUES (?, ?, ?, ?, ?)",
+                (name, category, quantity, price, supplier),
+            )
+            delta = cls._apply_db_changes(cur, before, [cur.lastrowid])
+        cls._apply_delta(delta)
         return "Product added successfully (DB)"
 
     @classmethod
@@ -126,29 +834,41 @@ class Product:
 
         if not sets:
             return "Nothing to update"
+        if quantity is not None and quantity < 0:
+            return "Invalid quantity"
+        if price is not None and price < 0:
+            return "Invalid price"
 
         params.append(product_id)
 
-        conn = get_conn()
-        cur = conn.cursor()
-        cur.execute(f"UPDATE products SET {', '.join(sets)} WHERE product_id = ?", params)
-        conn.commit()
-        changed = cur.rowcount
-        conn.close()
-
-        cls.load_from_db()
+        with transaction() as cur:
+            before = read_version(cur, "products")
+            if quantity is not None:
+                # không được hạ quantity xuống dưới phần đang bị giữ (available âm, hold không commit được)
+                cur.execute("SELECT reserved FROM products WHERE product_id = ?", (product_id,))
+                row = cur.fetchone()
+                if row is None:
+                    return "Product not found"
+                if quantity < row[0]:
+                    return "Invalid quantity"
+            cur.execute(f"UPDATE products SET {', '.join(sets)} WHERE product_id = ?", params)
+            changed = cur.rowcount
+            delta = cls._apply_db_changes(cur, before, [product_id]) if changed else None
+
+        if delta:
+            cls._apply_delta(delta)
         return "Product information updated successfully (DB)" if changed else "Product not found"
 
     @classmethod
     def delete_product_db(cls, product_id):
-        conn = get_conn()
-        cur = conn.cursor()
-        cur.execute("DELETE FROM products WHERE product_id = ?", (product_id,))
-        conn.commit()
-        changed = cur.rowcount
-        conn.close()
-
-        cls.load_from_db()
+        with transaction() as cur:
+            before = read_version(cur, "products")
+            cur.execute("DELETE FROM products WHERE product_id = ?", (product_id,))
+            changed = cur.rowcount
+            delta = cls._apply_db_changes(cur, before, [product_id]) if changed else None
+
+        if delta:
+            cls._apply_delta(delta)
         return "Product deleted successfully (DB)" if changed else "Product not found"
 
 
@@ -159,7 +879,7 @@ class Product:
             return "Product not found"
 
         if quantity is not None:
-            if quantity < 0:
+            if quantity < 0 or quantity < p.reserved:
                 return "Invalid quantity"
             p.quantity = quantity
 
@@ -169,7 +889,7 @@ class Product:
             p.price = price
 
         if supplier is not None:
-            p.supplier = supplier
+            cls._reindex(p, p.category, supplier)
 
         return "Product information updated successfully"
 
@@ -178,7 +898,7 @@ class Product:
         p = cls.find_by_id(product_id)
         if not p:
             return "Product not found"
-        cls.inventory.remove(p)
+        cls._unregister(p)
         return "Product deleted successfully"
 
     @classmethod
@@ -189,7 +909,7 @@ class Product:
 
         print("\n=== DANH SÁCH SẢN PHẨM TRONG KHO ===")
         for p in cls.inventory:
-            print(f"ID:{p.product_id} | {p.name} | Cate:{p.category} | Qty:{p.quantity} | ${p.price} | Supplier:{p.supplier}")
+            print(f"ID:{p.product_id} | {p.name} | Cate:{p.category} | Qty:{p.quantity} | Reserved:{p.reserved} | ${p.price} | Supplier:{p.supplier}")
 
     @classmethod
     def low_stock_alert(cls, threshold=3):
@@ -204,30 +924,208 @@ class Product:
     
     @classmethod
     def decrease_stock_db(cls, product_id: int, qty: int):
-        conn = get_conn()
-        cur = conn.cursor()
+        with transaction() as cur:
+            before = read_version(cur, "products")
 
-        # chỉ trừ nếu còn đủ hàng (an toàn)
-        cur.execute(
-            "UPDATE products SET quantity = quantity - ? WHERE product_id = ? AND quantity >= ?",
-            (qty, product_id, qty)
-        )
-        conn.commit()
-        changed = cur.rowcount
-        conn.close()
+            # chỉ trừ nếu còn đủ hàng chưa bị giữ (an toàn)
+            cur.execute(
+                "UPDATE products SET quantity = quantity - ? WHERE product_id = ? AND quantity - reserved >= ?",
+                (qty, product_id, qty)
+            )
+            changed = cur.rowcount
+            delta = cls._apply_db_changes(cur, before, [product_id]) if changed else None
 
-        cls.load_from_db()
+        if delta:
+            cls._apply_delta(delta)
         return changed == 1
 
+    @classmethod
+    def bulk_upsert_db(cls, rows, chunk_size=BULK_CHUNK_SIZE):
+        # rows: iterable (line_no, record, parse_error) từ iter_product_rows (stream, không load hết file)
+        # mỗi chunk = 1 transaction executemany; có product_id => upsert, không có => insert mới
+        report = {"processed": 0, "upserted": 0, "error_count": 0, "errors": []}
+
+        def add_error(line_no, msg):
+            report["error_count"] += 1
+            if len(report["errors"]) < MAX_REPORTED_ERRORS:
+                report["errors"].append({"line": line_no, "error": msg})
+
+        chunk = []
+        for line_no, record, parse_error in rows:
+            report["processed"] += 1
+            if parse_error:
+                add_error(line_no, parse_error)
+                continue
+            try:
+                chunk.append((line_no, validate_product_row(record)))
+            except ValueError as e:
+                add_error(line_no, str(e))
+                continue
+
+            if len(chunk) >= chunk_size:
+                report["upserted"] += cls._upsert_chunk(chunk, add_error)
+                chunk = []
+
+        if chunk:
+            report["upserted"] += cls._upsert_chunk(chunk, add_error)
+
+        # refresh cache đúng 1 lần sau khi import xong
+        if report["upserted"]:
+            cls.refresh_from_db()
+        return report
+
+    @classmethod
+    def _upsert_chunk(cls, chunk, add_error):
+        # chunk: [(line_no, row)]; trả về số dòng đã ghi, dòng bị từ chối báo qua add_error
+        new_rows = [r[1:] for _, r in chunk if r[0] is None]
+
+        with transaction() as cur:
+            # quantity mới không được thấp hơn phần đang bị giữ (đọc trong write lock => không đổi giữa chừng)
+            cur.execute(
+                "SELECT product_id, reserved FROM products WHERE reserved > 0 AND product_id IN (SELECT value FROM json_each(?))",
+                (json.dumps([r[0] for _, r in chunk if r[0] is not None]),)
+            )
+            reserved = dict(cur.fetchall())
+            with_id = []
+            for line_no, r in chunk:
+                if r[0] is None:
+                    continue
+                if r[3] < reserved.get(r[0], 0):
+                    add_error(line_no, f"quantity cannot be lower than reserved ({reserved[r[0]]})")
+                    continue
+                with_id.append(r)
+            if with_id:
+                cur.executemany("""
+                    INSERT INTO products (product_id, name, category, quantity, price, supplier)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(product_id) DO UPDATE SET
+                        name = excluded.name,
+                        category = excluded.category,
+                        quantity = excluded.quantity,
+                        price = excluded.price,
+                        supplier = excluded.supplier
+                """, with_id)
+                log_changes(cur, "product", [(r[0], "upsert") for r in with_id])
+            if new_rows:
+                # id tự cấp luôn > id lớn nhất hiện có => các dòng mới là mọi id > max trước khi insert
+                cur.execute("SELECT COALESCE(MAX(product_id), 0) FROM products")
+                max_before = cur.fetchone()[0]
+                cur.executemany(
+                    "INSERT INTO products (name, category, quantity, price, supplier) VALUES (?, ?, ?, ?, ?)",
+                    new_rows
+                )
+                cur.execute("""
+                    INSERT INTO change_log (entity, entity_id, op, created_at)
+                    SELECT 'product', product_id, 'upsert', ? FROM products WHERE product_id > ?
+                """, (time.time(), max_before))
+            if with_id or new_rows:
+                bump_version(cur, "products")
+        return len(with_id) + len(new_rows)
+
+
+def iter_csv_chunks(rows, rows_per_chunk=1000):
+    # biến iterator các dòng thành từng khúc text CSV (cho StreamingResponse)
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    n = 0
+    try:
+        for row in rows:
+            writer.writerow(row)
+            n += 1
+            if n >= rows_per_chunk:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+                n = 0
+        if n:
+            yield buf.getvalue()
+    finally:
+        # client ngắt giữa chừng => đóng generator nguồn để trả connection ngay
+        if hasattr(rows, "close"):
+            rows.close()
+
+def validate_product_row(record):
+    # cùng luật với Product.__post_init__, trả về (product_id, name, category, quantity, price, supplier)
+    if not isinstance(record, dict):
+        raise ValueError("row must be an object")
+
+    values = {}
+    for field in ("name", "category", "supplier"):
+        v = record.get(field)
+        if v is None or str(v).strip() == "":
+            raise ValueError(f"{field} is required")
+        values[field] = str(v).strip()
+
+    pid = record.get("product_id", record.get("id"))
+    try:
+        pid = int(pid) if pid not in (None, "") else None
+        quantity = int(record.get("quantity"))
+        price = float(record.get("price"))
+    except (TypeError, ValueError):
+        raise ValueError("product_id/quantity/price must be numbers")
+
+    if quantity < 0:
+        raise ValueError("quantity cannot be negative")
+    if price < 0:
+        raise ValueError("price cannot be negative")
+    return (pid, values["name"], values["category"], quantity, price, values["supplier"])
+
+def detect_import_format(filename):
+    return "ndjson" if filename.lower().endswith((".ndjson", ".jsonl", ".json")) else "csv"
+
+def iter_product_rows(f, fmt="csv"):
+    # stream parse từng dòng (file text), yield (line_no, record, parse_error)
+    if fmt == "ndjson":
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield line_no, json.loads(line), None
+            except json.JSONDecodeError as e:
+                yield line_no, None, f"invalid JSON: {e.msg}"
+        return
+
+    reader = csv.DictReader(f)
+    for record in reader:
+        # line_num của header = 1 => dòng dữ liệu đầu tiên = 2
+        yield reader.line_num, record, None
+
+
+def _request_hash(order, payload):
+    # cùng Idempotency-Key phải đi kèm đúng request ban đầu (customer + items / hold)
+    body = json.dumps([order.customer_info, payload], separators=(",", ":"))
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+def _stored_response(cur, key, now):
+    # key quá hạn (chưa kịp compact) coi như chưa thấy
+    cur.execute(
+        "SELECT request_hash, order_id, message, total FROM idempotency_keys WHERE key = ? AND created_at >= ?",
+        (key, now - IDEMPOTENCY_TTL_SECONDS)
+    )
+    return cur.fetchone()
 
 
+class OrderRejected(Exception):
+    # đơn bị từ chối (hết hàng, sai số lượng...) => rollback transaction chứa nó
+    pass
+
 
 @dataclass
 class Order:
-    order_id: int
+    order_id: Optional[int]  # None => DB cấp id lúc ghi đơn (trong transaction)
     products: List[Tuple[int, int]]  # (product_id, quantity)
     customer_info: Optional[str] = None
+    created_at: Optional[float] = None  # unix time, gán lúc ghi đơn vào DB
+    hold_id: Optional[int] = None  # reservation đang giữ hàng cho giỏ này (CLI place_order)
+    idempotency_key: Optional[str] = None  # header Idempotency-Key của request tạo đơn
+    replayed: bool = False  # True => kết quả lấy lại từ lần gửi trước, không ghi gì thêm
+    total: Optional[float] = None  # tổng tiền theo giá lúc bán, có sau khi đơn đã được ghi
     orders_history = []  # chỗ cất tất cả đơn đã chốt
+    _version: ClassVar[Optional[int]] = None  # version của orders mà orders_history đang phản ánh
+    _seq: ClassVar[int] = 0  # seq change_log mà orders_history đã áp tới
+    # giống Product._lock: mọi thay đổi orders_history/_version/_seq đi qua lock này
+    # => writer xong không theo thứ tự không thể chèn cùng 1 đơn 2 lần
+    _lock: ClassVar = threading.RLock()
 
 
     def place_order(self, product_id, quantity, customer_info=None):
@@ -238,62 +1136,107 @@ class Order:
         if not p:
             return "Order could not be placed. Product not found or insufficient quantity."
 
-        if p.quantity < quantity:
+        if p.available < quantity:
             return "Order could not be placed. Product not found or insufficient quantity."
 
-        # trừ kho + ghi đơn
-        ok = Product.decrease_stock_db(product_id, quantity)
-        if not ok:
-            return "Order could not be placed. Product not found or insufficient quantity."
+        # giữ hàng (reservation có hạn) thay vì trừ kho ngay; checkout_db mới chuyển thành đã bán
+        # bỏ giỏ giữa chừng => hết hạn là sweeper trả hàng lại, không bị "mất" tồn kho
+        try:
+            if self.hold_id is None:
+                self.hold_id = Reservation.hold_db([(product_id, quantity)], customer=customer_info).hold_id
+            elif not Reservation.add_items_db(self.hold_id, [(product_id, quantity)]):
+                # reservation đã hết hạn => hàng giữ trước đó đã được trả lại
+                self.products.clear()
+                self.hold_id = None
+                return "Reservation expired, cart cleared. Please place the order again."
+        except OrderRejected as e:
+            return str(e)
 
         self.products.append((product_id, quantity))
         if customer_info:
             self.customer_info = customer_info
+        if self.order_id is None:
+            return "Order placed successfully. Order ID will be assigned at checkout."
         return f"Order placed successfully. Order ID: {self.order_id}"
 
 
     def total_price(self):
-        total = 0
+        # đơn đã chốt => tổng đã lưu theo giá lúc bán; giỏ chưa chốt => ước tính theo giá hiện tại
+        if self.total is not None:
+            return self.total
+        return sum(qty * price for _, qty, price in self._price_lines())
+
+    def _price_lines(self):
+        # (product_id, qty, unit_price) theo giá hiện tại, dùng lúc chốt đơn để chụp lại giá
+        lines = []
         for product_id, qty in self.products:
             p = Product.find_by_id(product_id)
-            if p:
-                total += p.price * qty
-        return total
+            lines.append((product_id, qty, p.price if p else 0))
+        return lines
 
     def checkout(self):
         # chốt đơn: lưu vào lịch sử
+        if self.created_at is None:
+            self.created_at = time.time()
+        lines = self._price_lines()
+        self.total = sum(qty * price for _, qty, price in lines)
         Order.orders_history.append({
             "order_id": self.order_id,
             "customer": self.customer_info,
-            "items": self.products.copy(),
-            "total": self.total_price()
+            "items": lines,
+            "total": self.total,
+            "created_at": self.created_at
         })
         return "Checkout success"
 
     @classmethod
     def total_revenue(cls):
-        total = 0
-        for o in cls.orders_history:
-            total += o["total"]
-        return total
+        # đọc số cộng dồn, không duyệt lịch sử
+        return cls.sales_totals()["total_revenue"]
 
     @classmethod
-    def top_selling_products(cls):
-        counter = {}
+    def sales_totals(cls):
+        with get_conn() as conn:
+            revenue, order_count = conn.execute(
+                "SELECT revenue, order_count FROM sales_totals WHERE id = 1"
+            ).fetchone()
+        return {"total_revenue": revenue, "order_count": order_count}
 
-        for o in cls.orders_history:
-            for pid, qty in o["items"]:
-                counter[pid] = counter.get(pid, 0) + qty
+    @classmethod
+    def top_selling(cls, limit=None):
+        # duyệt index units_sold từ cao xuống, dừng sau `limit` dòng
+        with get_conn() as conn:
+            rows = conn.execute("""
+                SELECT s.product_id, COALESCE(p.name, 'Product#' || s.product_id),
+                       s.units_sold, s.revenue, s.order_hits
+                FROM product_sales s
+                LEFT JOIN products p ON p.product_id = s.product_id
+                ORDER BY s.units_sold DESC
+                LIMIT ?
+            """, (-1 if limit is None else limit,)).fetchall()
+        return [
+            {"product_id": pid, "product_name": name, "units_sold": units, "revenue": revenue, "order_hits": hits}
+            for pid, name, units, revenue, hits in rows
+        ]
 
-        if not counter:
+    @classmethod
+    def rebuild_sales_aggregates(cls):
+        with transaction() as cur:
+            rebuild_sales_aggregates(cur)
+            # aggregate đổi => cache kết quả tính từ đó phải bỏ
+            bump_version(cur, "orders")
+
+    @classmethod
+    def top_selling_products(cls):
+        top = cls.top_selling()
+
+        if not top:
             print("Chưa có dữ liệu bán hàng.")
             return
 
         print("\n=== TOP BÁN CHẠY ===")
-        for pid, qty in sorted(counter.items(), key=lambda x: x[1], reverse=True):
-            p = Product.find_by_id(pid)
-            name = p.name if p else f"Product#{pid}"
-            print(f"{name}: {qty} units")
+        for row in top:
+            print(f"{row['product_name']}: {row['units_sold']} units")
 
 
     @classmethod
@@ -304,14 +1247,22 @@ class Order:
                 print(f"{p.name}: còn {p.quantity}")
 
 
+    @classmethod
+    def find_order(cls, order_id: int):
+        # orders_history (sắp theo order_id) chỉ giữ đơn chưa archive => không có thì đọc DB (nóng rồi archive)
+        history = cls.orders_history
+        i = bisect_left(history, order_id, key=itemgetter("order_id"))
+        if i < len(history) and history[i]["order_id"] == order_id:
+            return history[i]
+        with transaction(immediate=False) as cur:
+            for archived in (False, True):
+                for record in cls._iter_history_rows(cur, [order_id], archived):
+                    return record
+        return None
+
     @classmethod
     def print_invoice(cls, order_id: int):
-        # tìm order trong lịch sử
-        target = None
-        for o in cls.orders_history:
-            if o["order_id"] == order_id:
-                target = o
-                break
+        target = cls.find_order(order_id)
 
         if not target:
             print("Không tìm thấy order này.")
@@ -323,18 +1274,14 @@ class Order:
         print("----------------------------")
         print("Item | Qty | Price | Subtotal")
 
-        grand = 0
-        for pid, qty in target["items"]:
+        # giá = unit_price lưu lúc bán, đổi giá / xoá product sau này không làm hoá đơn đổi theo
+        for pid, qty, price in target["items"]:
             p = Product.find_by_id(pid)
-            # nếu product đã bị xóa khỏi kho sau này thì vẫn in được
             name = p.name if p else f"Product#{pid}"
-            price = p.price if p else 0
-            sub = price * qty
-            grand += sub
-            print(f"{name} | {qty} | {price} | {sub}")
+            print(f"{name} | {qty} | {price} | {price * qty}")
 
         print("----------------------------")
-        print(f"TOTAL: ${grand}")
+        print(f"TOTAL: ${target['total']}")
         print("============================\n")
 
 
@@ -348,106 +1295,883 @@ class Order:
             print(f"Order #{o['order_id']} | customer: {o['customer']} | items: {o['items']} | total: ${o['total']}")
 
     @classmethod
-    def export_sales_report_csv(cls, filename="sales_report.csv"):
-        # top selling
-        counter = {}
-        for o in cls.orders_history:
-            for pid, qty in o["items"]:
-                counter[pid] = counter.get(pid, 0) + qty
+    def iter_sales_report_rows(cls, low_stock_threshold=2):
+        # đọc thẳng từ DB trong 1 snapshot (connection riêng), không cần orders_history trong RAM
+        conn = _open_conn()
+        try:
+            conn.execute("BEGIN")
+            yield ["metric", "value"]
+            cur = conn.execute("SELECT revenue FROM sales_totals WHERE id = 1")
+            yield ["total_revenue", cur.fetchone()[0]]
+            yield []
+
+            # top selling: đọc bảng cộng dồn theo index units_sold, tên lấy bằng join
+            yield ["top_selling_product", "units_sold"]
+            yield from conn.execute("""
+                SELECT COALESCE(p.name, 'Product#' || s.product_id), s.units_sold
+                FROM product_sales s
+                LEFT JOIN products p ON p.product_id = s.product_id
+                ORDER BY s.units_sold DESC
+            """)
+
+            yield []
+            yield ["low_stock_product", "qty_left"]
+            yield from conn.execute(
+                "SELECT name, quantity FROM products WHERE quantity <= ? ORDER BY product_id",
+                (low_stock_threshold,)
+            )
+        finally:
+            conn.close()
 
-        top_list = sorted(counter.items(), key=lambda x: x[1], reverse=True)
+    @classmethod
+    def iter_orders_export_rows(cls):
+        # stream từng dòng từ cursor: giá lấy từ order_items.unit_price (giá lúc bán), tên join trong SQL
+        conn = _open_conn()
+        try:
+            conn.execute("BEGIN")  # 1 snapshot: đơn đang được archive không bị xuất 2 lần hoặc mất
+            yield ["order_id", "customer", "product_id", "product_name", "qty", "unit_price", "subtotal"]
+            # đơn đã archive (cũ hơn) trước, rồi tới bảng nóng
+            for suffix in ("_archive", ""):
+                yield from conn.execute(f"""
+                    SELECT i.order_id, o.customer, i.product_id,
+                           COALESCE(p.name, 'Product#' || i.product_id),
+                           i.qty, i.unit_price, i.qty * i.unit_price
+                    FROM order_items{suffix} i
+                    JOIN orders{suffix} o ON o.order_id = i.order_id
+                    LEFT JOIN products p ON p.product_id = i.product_id
+                    ORDER BY i.order_id, i.id
+                """)
+        finally:
+            conn.close()
 
+    @classmethod
+    def export_sales_report_csv(cls, filename="sales_report.csv"):
         with open(filename, "w", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow(["metric", "value"])
-            writer.writerow(["total_revenue", cls.total_revenue()])
-            writer.writerow([])
-
-            writer.writerow(["top_selling_product", "units_sold"])
-            for pid, qty in top_list:
-                p = Product.find_by_id(pid)
-                name = p.name if p else f"Product#{pid}"
-                writer.writerow([name, qty])
-
-            writer.writerow([])
-            writer.writerow(["low_stock_product", "qty_left"])
-            for p in Product.inventory:
-                if p.quantity <= 2:
-                    writer.writerow([p.name, p.quantity])
-
+            csv.writer(f).writerows(cls.iter_sales_report_rows())
         return f"Exported to {filename}"
 
     @classmethod
     def export_orders_csv(cls, filename="orders_history.csv"):
-        import csv
-
         with open(filename, "w", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow(["order_id", "customer", "product_id", "product_name", "qty", "unit_price", "subtotal"])
+            csv.writer(f).writerows(cls.iter_orders_export_rows())
+        return f"Exported to {filename}"
 
-            for o in cls.orders_history:
-                for pid, qty in o["items"]:
-                    p = Product.find_by_id(pid)
-                    name = p.name if p else f"Product#{pid}"
-                    price = p.price if p else 0
-                    subtotal = price * qty
-                    writer.writerow([o["order_id"], o["customer"], pid, name, qty, price, subtotal])
+    @classmethod
+    def refresh_from_db(cls):
+        if cls._version is None:
+            cls.load_history_from_db()
+        elif current_version("orders") != cls._version:
+            cls._sync_from_log()
 
-        return f"Exported to {filename}"
+    @classmethod
+    def _sync_from_log(cls):
+        # giống Product._sync_from_log: chỉ đọc các đơn có trong change_log sau seq đã thấy
+        with cls._lock:
+            if cls._version is None:
+                cls.load_history_from_db()
+                return
+            with transaction(immediate=False) as cur:
+                version = read_version(cur, "orders")
+                # thread khác đã sync xong trong lúc chờ lock => không còn gì để đọc
+                if version == cls._version:
+                    return
+                seq = read_change_seq(cur)
+                ids = changed_ids(cur, "order", cls._seq)
+                full = ids is None or len(ids) > max(64, len(cls.orders_history) * SYNC_FULL_RELOAD_RATIO)
+                records = None if full else list(cls._iter_history_rows(cur, ids))
+            if full:
+                cls.load_history_from_db()
+                return
+
+            history = cls.orders_history
+            if ids and history and min(ids) <= history[-1]["order_id"]:
+                # có đơn cũ bị sửa/xoá => bỏ bản cũ rồi chèn lại, giữ thứ tự theo order_id
+                changed = set(ids)
+                history[:] = [o for o in history if o["order_id"] not in changed]
+                history.extend(records)
+                history.sort(key=itemgetter("order_id"))
+            else:
+                history.extend(records)
+            cls._version = version
+            cls._seq = seq
+
+    @classmethod
+    def _iter_history_rows(cls, cur, order_ids=None, archived=False):
+        # 1 query join duy nhất, sắp theo order => gom nhóm từng đơn ngay khi đọc
+        # order_ids => chỉ đọc các đơn đó (đồng bộ từ change_log); archived => đọc bảng archive
+        where, params = "", ()
+        if order_ids is not None:
+            where, params = "WHERE o.order_id IN (SELECT value FROM json_each(?))", (json.dumps(order_ids),)
+        suffix = "_archive" if archived else ""
+        cur.execute(f"""
+            SELECT o.order_id, o.customer, o.created_at, o.total, i.product_id, i.qty, i.unit_price
+            FROM orders{suffix} o
+            LEFT JOIN order_items{suffix} i ON i.order_id = o.order_id
+            {where}
+            ORDER BY o.order_id, i.id
+        """, params)
+        loaded = 0
+        try:
+            for order_id, rows in groupby(cur, key=itemgetter(0)):
+                customer = created_at = total = None
+                items = []
+                for _, customer, created_at, total, pid, qty, unit_price in rows:
+                    loaded += 1
+                    if pid is None:
+                        continue  # đơn không có item (LEFT JOIN)
+                    items.append((pid, qty, unit_price))
+                if total is None:
+                    # đơn ghi trước khi có cột total mà chưa backfill
+                    total = sum(qty * price for _, qty, price in items)
+
+                yield {
+                    "order_id": order_id,
+                    "customer": customer,
+                    "items": items,
+                    "total": total,
+                    "created_at": created_at
+                }
+        finally:
+            metrics.add_rows(loaded)
+
+    @classmethod
+    def iter_history_db(cls):
+        # generator: stream lịch sử từ DB, không giữ hết trong RAM
+        # connection riêng (không lấy từ pool) vì generator có thể được đọc dần từ thread khác
+        conn = _open_conn()
+        try:
+            yield from cls._iter_history_rows(conn.cursor())
+        finally:
+            conn.close()
 
     @classmethod
     def load_history_from_db(cls):
-        cls.orders_history.clear()
-        conn = get_conn()
-        cur = conn.cursor()
+        # đọc DB ngoài lock (nạp nền lúc khởi động có thể lâu, không chặn writer đang ghi đơn)
+        # chỉ gán dưới lock, và bỏ qua nếu history đã mới hơn snapshot vừa đọc
+        with transaction(immediate=False) as cur:
+            version = read_version(cur, "orders")
+            seq = read_change_seq(cur)
+            history = list(cls._iter_history_rows(cur))
+
+        with cls._lock:
+            if cls._version is not None and cls._version >= version:
+                return
+            cls.orders_history[:] = history
+            cls._version = version
+            cls._seq = seq
+
+    def place_order_db(self, items, customer_info=None):
+        # giữ hàng + ghi order + order_items trong 1 transaction duy nhất (BEGIN IMMEDIATE)
+        # lỗi giữa chừng => rollback hết, không có chuyện trừ kho mà không có đơn
+        # trả về (message, total); total = None nghĩa là đơn không được ghi
+        if customer_info:
+            self.customer_info = customer_info
+        return Order.place_orders_db([(self, items)])[0]
 
-        cur.execute("SELECT order_id, customer FROM orders ORDER BY order_id")
-        orders = cur.fetchall()
+    @classmethod
+    def place_orders_db(cls, requests):
+        # group commit: nhiều đơn [(order, items), ...] trong 1 transaction + 1 lần fsync
+        # mỗi đơn nằm trong SAVEPOINT riêng => đơn lỗi chỉ rollback phần của nó
+        # trả về [(message, total), ...] theo đúng thứ tự requests
+        return cls._write_orders(requests, cls._write_in_txn)
 
-        for order_id, customer in orders:
-            cur.execute("SELECT product_id, qty, unit_price FROM order_items WHERE order_id = ?", (order_id,))
-            items_rows = cur.fetchall()
+    @classmethod
+    def place_batch_db(cls, requests, policy="reject", chunk_size=ORDER_BATCH_CHUNK_SIZE):
+        # batch lớn (POS, đồng bộ marketplace): kiểm tra tồn kho cho cả batch trên 1 snapshot đọc
+        # (không giữ write lock), rồi ghi theo từng chunk transaction qua _write_orders
+        # policy "reject": thiếu bất kỳ món nào => từ chối cả đơn; "fill": bán phần còn lại
+        # trả về [(message, total), ...] theo thứ tự requests; order.products = các dòng thật sự đã bán
+        if policy not in PARTIAL_STOCK_POLICIES:
+            raise ValueError(f"policy must be one of {PARTIAL_STOCK_POLICIES}")
+        plans = cls._plan_batch(requests, policy)
+
+        def write(order, cur, items):
+            plan = plans[id(order)]
+            if plan is None:
+                # key còn lúc lập kế hoạch nhưng đã hết hạn trước lúc ghi => đơn mới thật sự,
+                # lập lại kế hoạch theo tồn kho hiện tại (đang giữ write lock nên số liệu không đổi nữa)
+                available = {
+                    pid: (r[3] - r[6] if r else 0)
+                    for pid, r in Product._fetch_rows(cur, list({pid for pid, _ in items})).items()
+                }
+                plan = cls._plan_order(items, available, policy)
+            if isinstance(plan, str):
+                raise OrderRejected(plan)
+            if policy == "fill":
+                return order._fill_in_txn(cur, plan)
+            return order._write_in_txn(cur, plan)
+
+        results = []
+        for i in range(0, len(requests), chunk_size):
+            results.extend(cls._write_orders(requests[i:i + chunk_size], write))
+        return results
 
-            items = [(pid, qty) for pid, qty, _ in items_rows]
-            total = sum(qty * unit_price for _, qty, unit_price in items_rows)
+    @classmethod
+    def _plan_batch(cls, requests, policy):
+        # {id(order): items sẽ ghi | lý do từ chối}; các đơn trừ dần vào cùng 1 bản tồn kho theo thứ tự
+        product_ids = list({pid for _, items in requests for pid, _ in items})
+        now = time.time()
+        plans = {}
+        seen_keys = set()  # key lặp lại trong cùng batch: _write_orders chỉ ghi bản đầu, các bản sau là replay
+        with transaction(immediate=False) as cur:
+            available = {
+                pid: (r[3] - r[6] if r else 0)
+                for pid, r in Product._fetch_rows(cur, product_ids).items()
+            }
+            for order, items in requests:
+                key = order.idempotency_key
+                if key is not None:
+                    if key in seen_keys or _stored_response(cur, key, now):
+                        plans[id(order)] = None  # retry => _write_orders trả lại kết quả cũ, không giữ hàng
+                        continue
+                    seen_keys.add(key)
+                plans[id(order)] = cls._plan_order(items, available, policy)
+        return plans
+
+    @staticmethod
+    def _plan_order(items, available, policy):
+        if not items:
+            return "No items in order"
+        if any(qty <= 0 for _, qty in items):
+            return "Invalid order quantity"
+        wanted = {}
+        for pid, qty in items:
+            wanted[pid] = wanted.get(pid, 0) + qty
+
+        if policy == "reject":
+            if any(available[pid] < qty for pid, qty in wanted.items()):
+                return "Order could not be placed. Product not found or insufficient quantity."
+            for pid, qty in wanted.items():
+                available[pid] -= qty
+            return items
+
+        filled = []
+        for pid, qty in wanted.items():
+            take = min(qty, available[pid])
+            if take > 0:
+                available[pid] -= take
+                filled.append((pid, take))
+        return filled or "Order could not be placed. No stock available for any item."
+
+    def _fill_in_txn(self, cur, items):
+        # như _write_in_txn nhưng bán tối đa phần đang còn (tồn kho có thể đã đổi sau lúc lập kế hoạch)
+        lines = []
+        for pid, qty in items:
+            cur.execute("SELECT quantity - reserved, price FROM products WHERE product_id = ?", (pid,))
+            row = cur.fetchone()
+            take = min(qty, row[0]) if row else 0
+            if take <= 0:
+                continue
+            cur.execute("UPDATE products SET quantity = quantity - ? WHERE product_id = ?", (take, pid))
+            lines.append((pid, take, row[1]))
+        if not lines:
+            raise OrderRejected("Order could not be placed. No stock available for any item.")
+
+        self._record_lines(cur, lines)
+        return lines
+
+    def commit_hold_db(self, hold_id, customer_info=None):
+        # chốt reservation thành đơn: chỉ chuyển reserved -> đã bán, không cần kiểm tra tồn kho lại
+        if customer_info:
+            self.customer_info = customer_info
+        return Order.commit_holds_db([(self, hold_id)])[0]
 
-            cls.orders_history.append({
-                "order_id": order_id,
-                "customer": customer,
-                "items": items,
-                "total": total
+    @classmethod
+    def commit_holds_db(cls, requests):
+        # [(order, hold_id), ...], group commit giống place_orders_db
+        return cls._write_orders(requests, cls._commit_hold_in_txn)
+
+    @classmethod
+    def _write_orders(cls, requests, write):
+        # write(order, cur, payload) -> lines [(product_id, qty, unit_price)], raise OrderRejected nếu không ghi được
+        results = []
+        placed = []  # (order, lines) của các đơn đã ghi thành công
+
+        now = time.time()
+        with transaction() as cur:
+            products_before = read_version(cur, "products")
+            orders_before = read_version(cur, "orders")
+
+            for order, items in requests:
+                key = order.idempotency_key
+                if key is not None:
+                    # key đã có (kể cả key trùng trong cùng batch) => trả lại kết quả cũ, không đụng kho
+                    fingerprint = _request_hash(order, items)
+                    stored = _stored_response(cur, key, now)
+                    if stored is not None:
+                        results.append(order._replay(stored, fingerprint))
+                        continue
+
+                original_id = order.order_id
+                cur.execute("SAVEPOINT place_order")
+                try:
+                    lines = write(order, cur, items)
+                except (OrderRejected, sqlite3.IntegrityError) as e:
+                    cur.execute("ROLLBACK TO place_order")
+                    cur.execute("RELEASE place_order")
+                    order.order_id = original_id
+                    order.total = None
+                    msg = str(e) if isinstance(e, OrderRejected) else "Order could not be placed. Order ID already exists."
+                    result = (msg, None)
+                else:
+                    cur.execute("RELEASE place_order")
+                    placed.append((order, lines))
+                    result = ("Checkout success (DB)", order.total)
+
+                if key is not None:
+                    # cùng transaction với đơn: commit cả 2 hoặc không gì cả
+                    # (đơn bị từ chối cũng lưu => retry nhận đúng kết quả ban đầu)
+                    cur.execute(
+                        "INSERT OR REPLACE INTO idempotency_keys (key, request_hash, order_id, message, total, created_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (key, fingerprint, order.order_id if result[1] is not None else None, result[0], result[1], now)
+                    )
+                results.append(result)
+
+            if not placed:
+                return results
+
+            touched = {pid for _, lines in placed for pid, _, _ in lines}
+            delta = Product._apply_db_changes(cur, products_before, touched)
+            log_changes(cur, "order", [(order.order_id, "insert") for order, _ in placed])
+            orders_after = bump_version(cur, "orders")
+            orders_seq = read_change_seq(cur)
+
+        # commit xong mới cập nhật cache trong RAM (chỉ những dòng bị đụng tới)
+        Product._apply_delta(delta)
+        records = []
+        for order, lines in placed:
+            # đơn từ reservation: giỏ đã có sẵn món (place_order) => thay bằng đúng các dòng đã ghi
+            if order.hold_id is not None:
+                order.products.clear()
+                order.hold_id = None
+            order.products.extend((pid, qty) for pid, qty, _ in lines)
+            records.append({
+                "order_id": order.order_id,
+                "customer": order.customer_info,
+                "items": lines,
+                "total": order.total,
+                "created_at": order.created_at
             })
+        cls._append_history(orders_before, orders_after, records, orders_seq)
+        return results
+
+    def replay_if_seen(self, items):
+        # đường nhanh cho retry: 1 lần tra index, không lấy write lock; None => chưa thấy key
+        if self.idempotency_key is None:
+            return None
+        with get_conn() as conn:
+            stored = _stored_response(conn.cursor(), self.idempotency_key, time.time())
+        if stored is None:
+            return None
+        return self._replay(stored, _request_hash(self, items))
+
+    def _replay(self, stored, fingerprint):
+        request_hash, order_id, message, total = stored
+        if request_hash != fingerprint:
+            return IDEMPOTENCY_CONFLICT, None
+        self.order_id = order_id
+        self.replayed = True
+        return message, total
 
-        conn.close()
+    @classmethod
+    def compact_idempotency_keys(cls, now=None, batch_size=5000):
+        # xoá key quá hạn theo batch (transaction ngắn), trả về số key đã xoá
+        cutoff = (time.time() if now is None else now) - IDEMPOTENCY_TTL_SECONDS
+        removed = 0
+        while True:
+            with transaction() as cur:
+                cur.execute("""
+                    DELETE FROM idempotency_keys WHERE rowid IN (
+                        SELECT rowid FROM idempotency_keys WHERE created_at < ? LIMIT ?
+                    )
+                """, (cutoff, batch_size))
+                n = cur.rowcount
+            removed += n
+            if n < batch_size:
+                return removed
+
+    @classmethod
+    def archive_db(cls, older_than_seconds, now=None, batch_size=ARCHIVE_BATCH_SIZE):
+        # chuyển đơn cũ hơn older_than_seconds (và đơn không có created_at) sang bảng archive theo batch
+        # trả về số đơn đã chuyển; cache của process này bỏ luôn các đơn đó khỏi orders_history
+        cutoff = (time.time() if now is None else now) - older_than_seconds
+        archived = 0
+        while True:
+            with transaction() as cur:
+                before = read_version(cur, "orders")
+                # giữ lại đơn có order_id lớn nhất: rowid tự cấp = max + 1, xoá nó thì id sẽ bị cấp lại
+                cur.execute("""
+                    SELECT order_id FROM orders
+                    WHERE (created_at IS NULL OR created_at < ?)
+                      AND order_id < (SELECT MAX(order_id) FROM orders)
+                    ORDER BY order_id LIMIT ?
+                """, (cutoff, batch_size))
+                ids = [r[0] for r in cur.fetchall()]
+                if not ids:
+                    return archived
+
+                params = (json.dumps(ids),)
+                cur.execute("""
+                    INSERT INTO orders_archive (order_id, customer, created_at, total, archived_at)
+                    SELECT order_id, customer, created_at, total, ? FROM orders
+                    WHERE order_id IN (SELECT value FROM json_each(?))
+                """, (time.time(),) + params)
+                cur.execute("""
+                    INSERT INTO order_items_archive (id, order_id, product_id, qty, unit_price)
+                    SELECT id, order_id, product_id, qty, unit_price FROM order_items
+                    WHERE order_id IN (SELECT value FROM json_each(?))
+                """, params)
+                cur.execute("DELETE FROM order_items WHERE order_id IN (SELECT value FROM json_each(?))", params)
+                cur.execute("DELETE FROM orders WHERE order_id IN (SELECT value FROM json_each(?))", params)
+
+                log_changes(cur, "order", [(oid, "archive") for oid in ids])
+                after = bump_version(cur, "orders")
+                # analytics.OrderLines thấy version này đổi => nạp lại chỉ phần còn trong bảng nóng
+                bump_version(cur, "orders_archive")
+                seq = read_change_seq(cur)
+
+            cls._remove_history(before, after, ids, seq)
+            archived += len(ids)
+            if len(ids) < batch_size:
+                return archived
+
+    def _write_in_txn(self, cur, items):
+        # trừ kho + ghi order/order_items, gọi bên trong transaction đang mở
+        # hết hàng/sai số lượng => raise OrderRejected để caller rollback
+        if not items:
+            raise OrderRejected("No items in order")
+        for _, qty in items:
+            if qty <= 0:
+                raise OrderRejected("Invalid order quantity")
+
+        lines = []  # (product_id, qty, unit_price)
+        for pid, qty in items:
+            cur.execute(
+                "UPDATE products SET quantity = quantity - ? WHERE product_id = ? AND quantity - reserved >= ?",
+                (qty, pid, qty)
+            )
+            if cur.rowcount != 1:
+                raise OrderRejected("Order could not be placed. Product not found or insufficient quantity.")
+            cur.execute("SELECT price FROM products WHERE product_id = ?", (pid,))
+            lines.append((pid, qty, cur.fetchone()[0]))
+
+        self._record_lines(cur, lines)
+        return lines
+
+    def _commit_hold_in_txn(self, cur, hold_id):
+        # hàng đã được giữ sẵn => chỉ trừ quantity + reserved cùng lúc, rồi xoá reservation
+        items = Reservation._active_items(cur, hold_id, time.time())
+        if not items:
+            raise OrderRejected("Reservation not found or expired.")
+
+        lines = []
+        for pid, qty in items:
+            cur.execute(
+                "UPDATE products SET quantity = quantity - ?, reserved = reserved - ? "
+                "WHERE product_id = ? AND reserved >= ? AND quantity >= ?",
+                (qty, qty, pid, qty, qty)
+            )
+            if cur.rowcount != 1:
+                raise OrderRejected("Order could not be placed. Product not found or insufficient quantity.")
+            cur.execute("SELECT price FROM products WHERE product_id = ?", (pid,))
+            lines.append((pid, qty, cur.fetchone()[0]))
+
+        Reservation._delete(cur, [hold_id])
+        self._record_lines(cur, lines)
+        return lines
+
+    def _record_lines(self, cur, lines):
+        # ghi order (kèm total theo giá lúc bán) + order_items + số liệu bán hàng cho các dòng đã trừ kho
+        self.total = sum(qty * price for _, qty, price in lines)
+        self._insert_order_row(cur)
+        cur.executemany(
+            "INSERT INTO order_items (order_id, product_id, qty, unit_price) VALUES (?, ?, ?, ?)",
+            [(self.order_id, pid, qty, price) for pid, qty, price in lines]
+        )
+        record_sale(cur, lines, self.created_at)
 
     def checkout_db(self):
+        # giỏ đang giữ hàng bằng reservation => chốt reservation (reserved -> đã bán)
+        if self.hold_id is not None:
+            msg, total = self.commit_hold_db(self.hold_id)
+            if total is None:
+                # không chốt được => trả hàng đang giữ, giỏ làm lại từ đầu
+                Reservation.release_db(self.hold_id)
+                self.products.clear()
+                self.hold_id = None
+            return msg
+
         # lưu order + items vào DB
-        conn = get_conn()
-        cur = conn.cursor()
+        with transaction() as cur:
+            before = read_version(cur, "orders")
 
-        cur.execute("INSERT INTO orders (order_id, customer) VALUES (?, ?)", (self.order_id, self.customer_info))
+            # chụp giá hiện tại vào order_items lúc chốt
+            lines = self._price_lines()
+            self._record_lines(cur, lines)
+            log_changes(cur, "order", [(self.order_id, "insert")])
 
-        for pid, qty in self.products:
-            p = Product.find_by_id(pid)
-            unit_price = p.price if p else 0
+            after = bump_version(cur, "orders")
+            seq = read_change_seq(cur)
+
+        # update cache history trong app (chỉ thêm đơn vừa chốt)
+        Order._append_history(before, after, [{
+            "order_id": self.order_id,
+            "customer": self.customer_info,
+            "items": lines,
+            "total": self.total,
+            "created_at": self.created_at
+        }], seq)
+        return "Checkout success (DB)"
+
+    def _insert_order_row(self, cur):
+        # order_id NULL => SQLite tự cấp rowid (max + 1) ngay trong transaction ghi đang giữ write lock
+        # nên 2 request song song không thể nhận trùng id
+        if self.created_at is None:
+            self.created_at = time.time()
+        if self.order_id is not None:
+            # id tự chọn trùng đơn đã archive => coi như trùng khoá giống bảng nóng
+            cur.execute("SELECT 1 FROM orders_archive WHERE order_id = ?", (self.order_id,))
+            if cur.fetchone():
+                raise sqlite3.IntegrityError("order_id already exists in orders_archive")
+        cur.execute(
+            "INSERT INTO orders (order_id, customer, created_at, total) VALUES (?, ?, ?, ?)",
+            (self.order_id, self.customer_info, self.created_at, self.total)
+        )
+        self.order_id = cur.lastrowid
+
+    @classmethod
+    def _remove_history(cls, before, after, order_ids, seq):
+        with cls._lock:
+            if cls._version is None:
+                return  # history chưa nạp (đang nạp nền lúc khởi động) => lần nạp sẽ đọc trạng thái mới
+            # thread khác đã đưa history tới (hoặc qua) trạng thái này => thay đổi đã nằm trong history
+            if cls._version >= after:
+                return
+            if before != cls._version:
+                cls._sync_from_log()
+                return
+            removed = set(order_ids)
+            cls.orders_history[:] = [o for o in cls.orders_history if o["order_id"] not in removed]
+            cls._version = after
+            cls._seq = seq
+
+    @classmethod
+    def _append_history(cls, before, after, records, seq):
+        # process khác đã ghi đơn => history trong RAM đã lệch, bù từ change_log (đã gồm cả records)
+        with cls._lock:
+            if cls._version is None:
+                return  # history chưa nạp (đang nạp nền lúc khởi động) => lần nạp sẽ đọc trạng thái mới
+            if cls._version >= after:
+                return
+            if before != cls._version:
+                cls._sync_from_log()
+                return
+            cls.orders_history.extend(records)
+            cls._version = after
+            cls._seq = seq
+
+
+
+@dataclass
+class Reservation:
+    # giữ hàng có hạn: products.reserved tăng ngay, quantity chỉ giảm khi chốt đơn (commit)
+    # hết hạn mà chưa commit/release => expire_db (sweeper) trả hàng lại theo batch
+    hold_id: int
+    items: List[Tuple[int, int]]  # (product_id, qty)
+    expires_at: float
+    customer: Optional[str] = None
+    created_at: Optional[float] = None
+
+    @staticmethod
+    def _merge_items(items):
+        # cùng 1 product nhiều dòng => cộng lại (reservation_items khoá theo (hold_id, product_id))
+        merged = {}
+        for pid, qty in items:
+            if qty <= 0:
+                raise OrderRejected("Invalid order quantity")
+            merged[pid] = merged.get(pid, 0) + qty
+        if not merged:
+            raise OrderRejected("No items to reserve")
+        return sorted(merged.items())
+
+    @staticmethod
+    def _check_ttl(ttl):
+        # ttl <= 0 => reservation hết hạn ngay lúc tạo (hàng bị giữ tới lần sweep kế tiếp)
+        if not 0 < ttl <= MAX_HOLD_TTL_SECONDS:
+            raise OrderRejected(f"Hold TTL must be > 0 and <= {MAX_HOLD_TTL_SECONDS} seconds")
+
+    @staticmethod
+    def _reserve(cur, items):
+        for pid, qty in items:
+            cur.execute(
+                "UPDATE products SET reserved = reserved + ? WHERE product_id = ? AND quantity - reserved >= ?",
+                (qty, pid, qty)
+            )
+            if cur.rowcount != 1:
+                raise OrderRejected("Hold could not be placed. Product not found or insufficient quantity.")
+
+    @staticmethod
+    def _active_items(cur, hold_id, now):
+        cur.execute("""
+            SELECT i.product_id, i.qty
+            FROM reservations r
+            JOIN reservation_items i ON i.hold_id = r.hold_id
+            WHERE r.hold_id = ? AND r.expires_at > ?
+            ORDER BY i.product_id
+        """, (hold_id, now))
+        return cur.fetchall()
+
+    @staticmethod
+    def _release_items(cur, hold_ids):
+        # trả hàng đang giữ của các reservation rồi xoá chúng; trả về product_id bị đụng tới
+        marks = ",".join("?" * len(hold_ids))
+        cur.execute(
+            f"SELECT product_id, SUM(qty) FROM reservation_items WHERE hold_id IN ({marks}) GROUP BY product_id",
+            hold_ids
+        )
+        released = cur.fetchall()
+        cur.executemany(
+            "UPDATE products SET reserved = MAX(reserved - ?, 0) WHERE product_id = ?",
+            [(qty, pid) for pid, qty in released]
+        )
+        Reservation._delete(cur, hold_ids)
+        return [pid for pid, _ in released]
+
+    @staticmethod
+    def _delete(cur, hold_ids):
+        params = [(h,) for h in hold_ids]
+        cur.executemany("DELETE FROM reservation_items WHERE hold_id = ?", params)
+        cur.executemany("DELETE FROM reservations WHERE hold_id = ?", params)
+
+    @classmethod
+    def hold_db(cls, items, ttl=HOLD_TTL_SECONDS, customer=None):
+        # tất cả hoặc không: thiếu 1 món => raise OrderRejected, transaction rollback
+        cls._check_ttl(ttl)
+        items = cls._merge_items(items)
+        now = time.time()
+        with transaction() as cur:
+            before = read_version(cur, "products")
+            cls._reserve(cur, items)
+            cur.execute(
+                "INSERT INTO reservations (hold_id, customer, created_at, expires_at) VALUES (NULL, ?, ?, ?)",
+                (customer, now, now + ttl)
+            )
+            hold_id = cur.lastrowid
+            cur.executemany(
+                "INSERT INTO reservation_items (hold_id, product_id, qty) VALUES (?, ?, ?)",
+                [(hold_id, pid, qty) for pid, qty in items]
+            )
+            delta = Product._apply_db_changes(cur, before, [pid for pid, _ in items])
+        Product._apply_delta(delta)
+        return cls(hold_id, items, now + ttl, customer, now)
+
+    @classmethod
+    def add_items_db(cls, hold_id, items, ttl=HOLD_TTL_SECONDS):
+        # thêm món vào reservation còn hạn (và gia hạn); False nếu reservation không còn
+        cls._check_ttl(ttl)
+        items = cls._merge_items(items)
+        now = time.time()
+        with transaction() as cur:
+            cur.execute("SELECT 1 FROM reservations WHERE hold_id = ? AND expires_at > ?", (hold_id, now))
+            if cur.fetchone() is None:
+                return False
+            before = read_version(cur, "products")
+            cls._reserve(cur, items)
+            cur.executemany("""
+                INSERT INTO reservation_items (hold_id, product_id, qty) VALUES (?, ?, ?)
+                ON CONFLICT(hold_id, product_id) DO UPDATE SET qty = qty + excluded.qty
+            """, [(hold_id, pid, qty) for pid, qty in items])
+            cur.execute("UPDATE reservations SET expires_at = ? WHERE hold_id = ?", (now + ttl, hold_id))
+            delta = Product._apply_db_changes(cur, before, [pid for pid, _ in items])
+        Product._apply_delta(delta)
+        return True
+
+    @classmethod
+    def extend_db(cls, hold_id, ttl=HOLD_TTL_SECONDS):
+        # gia hạn tính từ bây giờ; reservation đã hết hạn thì không hồi sinh lại được
+        cls._check_ttl(ttl)
+        now = time.time()
+        with transaction() as cur:
             cur.execute(
-                "INSERT INTO order_items (order_id, product_id, qty, unit_price) VALUES (?, ?, ?, ?)",
-                (self.order_id, pid, qty, unit_price)
+                "UPDATE reservations SET expires_at = ? WHERE hold_id = ? AND expires_at > ?",
+                (now + ttl, hold_id, now)
             )
+            if cur.rowcount != 1:
+                return None
+        return cls.find_db(hold_id)
+
+    @classmethod
+    def release_db(cls, hold_id):
+        with transaction() as cur:
+            cur.execute("SELECT 1 FROM reservations WHERE hold_id = ?", (hold_id,))
+            if cur.fetchone() is None:
+                return False
+            before = read_version(cur, "products")
+            touched = cls._release_items(cur, [hold_id])
+            delta = Product._apply_db_changes(cur, before, touched)
+        Product._apply_delta(delta)
+        return True
+
+    @classmethod
+    def expire_db(cls, now=None, batch_size=SWEEP_BATCH_SIZE):
+        # sweeper: mỗi batch 1 transaction ngắn để không giữ write lock lâu
+        now = time.time() if now is None else now
+        expired = 0
+        while True:
+            with transaction() as cur:
+                cur.execute(
+                    "SELECT hold_id FROM reservations WHERE expires_at <= ? ORDER BY expires_at LIMIT ?",
+                    (now, batch_size)
+                )
+                hold_ids = [r[0] for r in cur.fetchall()]
+                if not hold_ids:
+                    return expired
+                before = read_version(cur, "products")
+                touched = cls._release_items(cur, hold_ids)
+                delta = Product._apply_db_changes(cur, before, touched)
+            Product._apply_delta(delta)
+            expired += len(hold_ids)
+            if len(hold_ids) < batch_size:
+                return expired
 
-        conn.commit()
+    @classmethod
+    def find_db(cls, hold_id):
+        with transaction(immediate=False) as cur:
+            cur.execute("SELECT customer, created_at, expires_at FROM reservations WHERE hold_id = ?", (hold_id,))
+            row = cur.fetchone()
+            if row is None:
+                return None
+            cur.execute("SELECT product_id, qty FROM reservation_items WHERE hold_id = ? ORDER BY product_id", (hold_id,))
+            items = cur.fetchall()
+        return cls(hold_id, items, row[2], row[0], row[1])
+
+
+# ----- CHANGE FEED -----
+def open_change_feed(since=0, limit=None, batch_size=CHANGE_FEED_BATCH_SIZE):
+    # trả về (head, generator dòng NDJSON) cho các thay đổi có seq > since, theo thứ tự seq
+    # mỗi entity chỉ ra bản ghi mới nhất (<= head) kèm trạng thái hiện tại của nó
+    # kiểm tra cursor ngay (chưa stream) để API trả 410 thay vì cắt ngang response
+    conn = _open_conn()
+    try:
+        cur = conn.cursor()
+        cur.execute("BEGIN")  # 1 snapshot cho cả feed: head và dữ liệu khớp nhau
+        if since < read_version(cur, "change_log_floor"):
+            raise ChangeLogExpired("Change feed cursor has been compacted away; reload a full snapshot.")
+        head = read_change_seq(cur)
+    except BaseException:
         conn.close()
+        raise
+    return head, _iter_change_lines(conn, since, head, limit, batch_size)
 
-        # update cache history trong app
-        Order.load_history_from_db()
-        return "Checkout success (DB)"
+def _iter_change_lines(conn, since, head, limit, batch_size):
+    cur = conn.cursor()
+    sent = 0
+    try:
+        while limit is None or sent < limit:
+            n = batch_size if limit is None else min(batch_size, limit - sent)
+            cur.execute("""
+                SELECT c.seq, c.entity, c.entity_id, c.op FROM change_log c
+                WHERE c.seq > ? AND c.seq <= ? AND NOT EXISTS (
+                    SELECT 1 FROM change_log d
+                    WHERE d.entity = c.entity AND d.entity_id = c.entity_id AND d.seq > c.seq AND d.seq <= ?
+                )
+                ORDER BY c.seq LIMIT ?
+            """, (since, head, head, n))
+            batch = cur.fetchall()
+            if not batch:
+                return
+
+            product_ids = [eid for _, entity, eid, _ in batch if entity == "product"]
+            order_ids = [eid for _, entity, eid, _ in batch if entity == "order"]
+            products = Product._fetch_rows(cur, product_ids)
+            orders = {o["order_id"]: o for o in Order._iter_history_rows(cur, order_ids)} if order_ids else {}
+            archived_ids = [eid for _, entity, eid, op in batch if entity == "order" and op == "archive"]
+            if archived_ids:
+                orders.update((o["order_id"], o) for o in Order._iter_history_rows(cur, archived_ids, archived=True))
+
+            lines = []
+            for seq, entity, eid, op in batch:
+                if entity == "product":
+                    r = products.get(eid)
+                    data = None if r is None else dict(zip(
+                        ("product_id", "name", "category", "quantity", "price", "supplier", "reserved"), r
+                    ))
+                else:
+                    o = orders.get(eid)
+                    data = None if o is None else {
+                        **o, "items": [{"product_id": pid, "qty": qty, "unit_price": price} for pid, qty, price in o["items"]]
+                    }
+                # dòng đã bị xoá sau đó (trong snapshot) => báo delete
+                lines.append(json.dumps({
+                    "seq": seq, "entity": entity, "id": eid,
+                    "op": "delete" if data is None else op, "data": data,
+                }, ensure_ascii=False))
+            yield "\n".join(lines) + "\n"
+            sent += len(batch)
+            since = batch[-1][0]
+    finally:
+        conn.close()
+
+def compact_change_log(now=None, retention_seconds=CHANGE_LOG_RETENTION_SECONDS, batch_size=5000):
+    # 1) xoá bản ghi đã có bản mới hơn cho cùng entity: consumer nào cũng vẫn nhận bản mới => không đổi floor
+    # 2) xoá bản ghi quá retention theo thứ tự seq, nâng change_log_floor tới seq cuối đã xoá
+    superseded = 0
+    while True:
+        with transaction() as cur:
+            cur.execute("""
+                DELETE FROM change_log WHERE seq IN (
+                    SELECT c.seq FROM change_log c WHERE EXISTS (
+                        SELECT 1 FROM change_log d
+                        WHERE d.entity = c.entity AND d.entity_id = c.entity_id AND d.seq > c.seq
+                    )
+                    LIMIT ?
+                )
+            """, (batch_size,))
+            n = cur.rowcount
+        superseded += n
+        if n < batch_size:
+            break
+
+    cutoff = (time.time() if now is None else now) - retention_seconds
+    with transaction() as cur:
+        cur.execute("SELECT MAX(seq) FROM change_log WHERE created_at < ?", (cutoff,))
+        upto = cur.fetchone()[0]
+        if upto is not None:
+            # nâng floor trước khi xoá: cache/consumer ở sau mốc này sẽ reload thay vì bỏ sót
+            cur.execute(
+                "UPDATE data_versions SET version = MAX(version, ?) WHERE name = 'change_log_floor'",
+                (upto,)
+            )
+        floor = read_version(cur, "change_log_floor")
+
+    expired = 0
+    while upto is not None:
+        with transaction() as cur:
+            cur.execute("DELETE FROM change_log WHERE seq IN (SELECT seq FROM change_log WHERE seq <= ? LIMIT ?)", (upto, batch_size))
+            n = cur.rowcount
+        expired += n
+        if n < batch_size:
+            break
+    return {"superseded": superseded, "expired": expired, "floor": floor}
 
 
+# đo thời gian / số lần gọi các thao tác DB (xem metrics.py, GET /metrics)
+metrics.instrument(Product, [
+    "load_from_db", "load_snapshot", "save_snapshot", "refresh_from_db", "add_product_db", "update_product_db",
+    "delete_product_db", "decrease_stock_db", "bulk_upsert_db",
+])
+metrics.instrument(Order, [
+    "total_revenue", "sales_totals", "top_selling", "rebuild_sales_aggregates",
+    "refresh_from_db", "load_history_from_db", "place_order_db", "place_orders_db", "checkout_db",
+    "place_batch_db", "commit_hold_db", "commit_holds_db", "compact_idempotency_keys", "archive_db", "find_order",
+])
+metrics.instrument(Reservation, ["hold_db", "add_items_db", "extend_db", "release_db", "expire_db", "find_db"])
 
 
 def seed_data():
     # tạo sẵn 2 món để test
-    Product.inventory.clear()
+    Product.clear_cache()
     Product.add_product("Milk", "Dairy", 10, 2.5, "Supplier A")
     Product.add_product("Bread", "Bakery", 5, 1.8, "Supplier B")
     Product.add_product("Coke", "Drink", 3, 1.2, "Supplier C")
@@ -474,16 +2198,86 @@ def show_menu():
     print("0) Thoát")
 
 
+def run_cli(argv):
+    parser = argparse.ArgumentParser(prog="main.py")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_import = sub.add_parser("import-products", help="bulk import/upsert sản phẩm từ CSV hoặc NDJSON")
+    p_import.add_argument("file")
+    p_import.add_argument("--format", choices=["csv", "ndjson"])
+    p_import.add_argument("--chunk-size", type=int, default=BULK_CHUNK_SIZE)
+
+    sub.add_parser("rebuild-sales", help="tính lại bảng số liệu bán hàng từ order_items")
+    sub.add_parser("expire-holds", help="trả lại hàng của các reservation đã hết hạn")
+    sub.add_parser("compact-idempotency", help="xoá Idempotency-Key đã quá hạn")
+    sub.add_parser("backfill-order-totals", help="tính orders.total còn trống từ order_items")
+    p_archive = sub.add_parser("archive-orders", help="chuyển đơn cũ sang bảng archive")
+    p_archive.add_argument("--older-than-days", type=float, required=True)
+    p_snapshot = sub.add_parser("snapshot", help="ghi snapshot cache sản phẩm cho lần khởi động nhanh")
+    p_snapshot.add_argument("file", nargs="?")
+    p_compact = sub.add_parser("compact-changes", help="dọn change_log (bản ghi bị thay thế + quá hạn giữ)")
+    p_compact.add_argument("--retention-seconds", type=float, default=CHANGE_LOG_RETENTION_SECONDS)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "import-products":
+        fmt = args.format or detect_import_format(args.file)
+        with open(args.file, newline="", encoding="utf-8") as f:
+            report = Product.bulk_upsert_db(iter_product_rows(f, fmt), chunk_size=args.chunk_size)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return 1 if report["error_count"] else 0
+
+    if args.command == "rebuild-sales":
+        Order.rebuild_sales_aggregates()
+        print(json.dumps(Order.sales_totals()))
+        return 0
+
+    if args.command == "expire-holds":
+        print(json.dumps({"expired": Reservation.expire_db()}))
+        return 0
+
+    if args.command == "compact-idempotency":
+        print(json.dumps({"removed": Order.compact_idempotency_keys()}))
+        return 0
+
+    if args.command == "backfill-order-totals":
+        with transaction() as cur:
+            updated = backfill_order_totals(cur)
+        print(json.dumps({"updated": updated}))
+        return 0
+
+    if args.command == "archive-orders":
+        print(json.dumps({"archived": Order.archive_db(args.older_than_days * 86400)}))
+        return 0
+
+    if args.command == "snapshot":
+        path = args.file or f"{DB_FILE}.snapshot"
+        Product.load_from_db()
+        Product.save_snapshot(path)
+        print(json.dumps({"file": path, "products": len(Product.inventory), "bytes": os.path.getsize(path)}))
+        return 0
+
+    if args.command == "compact-changes":
+        print(json.dumps(compact_change_log(retention_seconds=args.retention_seconds)))
+        return 0
+
+
 if __name__ == "__main__":
     init_db()
 
+    # có tham số => chạy lệnh CLI (vd: python main.py import-products feed.csv) thay vì menu
+    if len(sys.argv) > 1:
+        sys.exit(run_cli(sys.argv[1:]))
+
     Product.load_from_db()
     Order.load_history_from_db()
+    # giỏ bỏ dở từ lần chạy trước => trả lại hàng đã hết hạn giữ
+    Reservation.expire_db()
 
 
 
     # seed_data()
-    order = Order(order_id=1, products=[])
+    order = Order(order_id=None, products=[])
 
     while True:
         show_menu()
@@ -512,8 +2306,8 @@ if __name__ == "__main__":
 
         elif choice == "5":
             print(order.checkout_db())
-            # tạo đơn mới (id + 1), giỏ trống
-            order = Order(order_id=order.order_id + 1, products=[])
+            # tạo đơn mới, giỏ trống (id do DB cấp khi chốt)
+            order = Order(order_id=None, products=[])
 
         elif choice == "6":
             Order.show_history()
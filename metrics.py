@@ -0,0 +1,326 @@
+import cProfile
+import functools
+import inspect
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from contextvars import ContextVar
+from functools import lru_cache
+
+
+# INVENTORY_METRICS=0 => connection sqlite thường, không đo gì ở tầng SQL
+ENABLED = os.getenv("INVENTORY_METRICS", "1") != "0"
+# > 0 => log mọi câu SQL chạy lâu hơn ngưỡng (ms)
+SLOW_QUERY_MS = float(os.getenv("INVENTORY_SLOW_QUERY_MS", "0"))
+# có thư mục => cho phép profile từng request (header X-Profile: 1 hoặc ?profile=1)
+PROFILE_DIR = os.getenv("INVENTORY_PROFILE_DIR") or None
+
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 50, 100, 1000, 10000, 100000, 1000000)
+
+slow_log = logging.getLogger("inventory.slow_query")
+
+
+class Registry:
+    # counter + histogram tối giản, xuất ra Prometheus text format
+    # label truyền qua kwargs; chỉ dùng label có ít giá trị (op, route, method...)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta = {}        # name -> (type, help, buckets)
+        self._counters = {}    # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+
+    def counter(self, name, help_text):
+        self._meta[name] = ("counter", help_text, None)
+
+    def histogram(self, name, help_text, buckets=SECONDS_BUCKETS):
+        self._meta[name] = ("histogram", help_text, tuple(buckets))
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        buckets = self._meta[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            h = self._histograms.get(key)
+            if h is None:
+                h = self._histograms[key] = [0] * len(buckets) + [0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    h[i] += 1
+                    break
+            h[-2] += value
+            h[-1] += 1
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {k: list(v) for k, v in self._histograms.items()}
+
+        lines = []
+        for name, (kind, help_text, buckets) in self._meta.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "counter":
+                for (n, labels), value in sorted(counters.items()):
+                    if n == name:
+                        lines.append(f"{name}{_labels(labels)} {_number(value)}")
+                continue
+            for (n, labels), h in sorted(histograms.items()):
+                if n != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets, h):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', _number(bound)),))} {cumulative}")
+                lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {h[-1]}")
+                lines.append(f"{name}_sum{_labels(labels)} {_number(h[-2])}")
+                lines.append(f"{name}_count{_labels(labels)} {h[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    parts = []
+    for k, v in labels:
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value) if not value.is_integer() else str(int(value))
+    return str(value)
+
+
+registry = Registry()
+registry.counter("inventory_db_connections_opened_total", "SQLite connections opened")
+registry.counter("inventory_db_rows_loaded_total", "Rows read from SQLite")
+registry.histogram("inventory_db_query_seconds", "SQL statement latency by statement kind")
+registry.histogram("inventory_operation_seconds", "Latency of Product/Order DB operations")
+registry.counter("inventory_operation_errors_total", "Product/Order DB operations that raised")
+registry.counter("inventory_http_requests_total", "HTTP requests by route, method and status")
+registry.histogram("inventory_http_request_seconds", "HTTP request latency until response headers")
+registry.histogram("inventory_request_db_queries", "SQL statements per HTTP request", COUNT_BUCKETS)
+registry.histogram("inventory_request_rows_loaded", "Rows read from SQLite per HTTP request", COUNT_BUCKETS)
+registry.histogram("inventory_request_connections_opened", "SQLite connections opened per HTTP request", COUNT_BUCKETS)
+registry.counter("inventory_request_operation_calls_total", "Product/Order DB operations run inside HTTP requests")
+
+
+# ----- PER REQUEST -----
+class RequestStats:
+    __slots__ = ("queries", "rows", "connections", "operations", "profile", "profile_file")
+
+    def __init__(self, profile=False):
+        self.queries = 0
+        self.rows = 0
+        self.connections = 0
+        self.operations = {}  # tên thao tác -> số lần gọi
+        self.profile = profile
+        self.profile_file = None
+
+
+_request: ContextVar[RequestStats | None] = ContextVar("inventory_request", default=None)
+
+
+def begin_request(profile=False):
+    # route sync chạy trên threadpool nhưng vẫn thấy context này (context được copy sang thread)
+    stats = RequestStats(profile=profile and PROFILE_DIR is not None)
+    return stats, _request.set(stats)
+
+
+def end_request(token, route, method, status, seconds):
+    stats = _request.get()
+    _request.reset(token)
+    registry.inc("inventory_http_requests_total", route=route, method=method, status=status)
+    registry.observe("inventory_http_request_seconds", seconds, route=route, method=method)
+    if stats is not None:
+        registry.observe("inventory_request_db_queries", stats.queries, route=route)
+        registry.observe("inventory_request_rows_loaded", stats.rows, route=route)
+        registry.observe("inventory_request_connections_opened", stats.connections, route=route)
+        for op, n in stats.operations.items():
+            registry.inc("inventory_request_operation_calls_total", n, route=route, operation=op)
+    return stats
+
+
+def add_rows(n):
+    # cho chỗ duyệt thẳng cursor (for r in cur) mà TracedCursor không đếm được
+    if not ENABLED or not n:
+        return
+    registry.inc("inventory_db_rows_loaded_total", n)
+    stats = _request.get()
+    if stats is not None:
+        stats.rows += n
+
+
+def connection_opened():
+    registry.inc("inventory_db_connections_opened_total")
+    stats = _request.get()
+    if stats is not None:
+        stats.connections += 1
+
+
+# ----- SQL -----
+_SQL_KIND = re.compile(r"\s*(\w+)")
+
+
+@lru_cache(maxsize=1024)
+def _statement_kind(sql):
+    m = _SQL_KIND.match(sql)
+    return m.group(1).lower() if m else "other"
+
+
+def _record_query(sql, seconds):
+    registry.observe("inventory_db_query_seconds", seconds, op=_statement_kind(sql))
+    stats = _request.get()
+    if stats is not None:
+        stats.queries += 1
+    if SLOW_QUERY_MS and seconds * 1000 >= SLOW_QUERY_MS:
+        slow_log.warning("slow query %.1f ms: %s", seconds * 1000, " ".join(sql.split()))
+
+
+def _record_rows(n):
+    if n:
+        registry.inc("inventory_db_rows_loaded_total", n)
+        stats = _request.get()
+        if stats is not None:
+            stats.rows += n
+
+
+class TracedCursor(sqlite3.Cursor):
+    # đo thời gian từng câu SQL + đếm row qua fetch*
+    # (duyệt thẳng cursor thì không đếm ở đây, chỗ đó gọi add_rows)
+
+    def execute(self, sql, parameters=()):
+        t0 = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_query(sql, time.perf_counter() - t0)
+
+    def executemany(self, sql, seq_of_parameters):
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record_query(sql, time.perf_counter() - t0)
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            _record_rows(1)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        _record_rows(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        _record_rows(len(rows))
+        return rows
+
+
+class TracedConnection(sqlite3.Connection):
+    # conn.execute() của sqlite3 không đi qua cursor().execute => override cả 2
+
+    def cursor(self, factory=TracedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def connection_factory():
+    return TracedConnection if ENABLED else sqlite3.Connection
+
+
+# ----- OPERATIONS -----
+def instrument(cls, names):
+    # bọc các method (classmethod hoặc method thường) để đo thời gian + đếm lỗi theo "Class.method"
+    if not ENABLED:
+        return
+    for name in names:
+        attr = inspect.getattr_static(cls, name)
+        if isinstance(attr, classmethod):
+            setattr(cls, name, classmethod(_timed(f"{cls.__name__}.{name}", attr.__func__)))
+        else:
+            setattr(cls, name, _timed(f"{cls.__name__}.{name}", attr))
+
+
+def _timed(op, fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        stats = _request.get()
+        if stats is not None:
+            stats.operations[op] = stats.operations.get(op, 0) + 1
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            registry.inc("inventory_operation_errors_total", operation=op)
+            raise
+        finally:
+            registry.observe("inventory_operation_seconds", time.perf_counter() - t0, operation=op)
+    return wrapper
+
+
+# ----- PROFILING -----
+def profiled(endpoint, label):
+    # cProfile phải bật trong đúng thread chạy endpoint (route sync chạy trên threadpool)
+    # nên bọc endpoint chứ không profile ở middleware
+    def dump(profile, stats):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        safe = re.sub(r"[^A-Za-z0-9_.-]+", "_", label).strip("_") or "root"
+        path = os.path.join(PROFILE_DIR, f"{time.time():.6f}-{safe}.prof")
+        profile.dump_stats(path)
+        stats.profile_file = path
+
+    if inspect.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def async_wrapper(*args, **kwargs):
+            stats = _request.get()
+            if stats is None or not stats.profile:
+                return await endpoint(*args, **kwargs)
+            # coroutine: các task khác chạy xen kẽ trên event loop cũng bị tính vào profile
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                profile.disable()
+                dump(profile, stats)
+        return async_wrapper
+
+    @functools.wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        stats = _request.get()
+        if stats is None or not stats.profile:
+            return endpoint(*args, **kwargs)
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            profile.disable()
+            dump(profile, stats)
+    return wrapper
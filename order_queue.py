@@ -0,0 +1,107 @@
+import asyncio
+
+from concurrent.futures import ThreadPoolExecutor
+
+from main import Order
+
+
+class OrderWriter:
+    # 1 writer duy nhất cho mọi thao tác ghi đơn/kho (SQLite chỉ cho 1 writer cùng lúc)
+    # các đơn đang chờ trong queue được gom thành 1 transaction (group commit)
+
+    def __init__(self, max_batch=256, max_wait_ms=2.0):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue = None
+        self._task = None
+        # 1 thread riêng cho DB => connection của thread này được dùng lại suốt
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="order-writer")
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            await self.queue.put(None)
+            await self._task
+            self._task = None
+        self._executor.shutdown(wait=True)
+
+    async def submit_order(self, order, items):
+        # trả về (message, total) giống Order.place_order_db
+        fut = asyncio.get_running_loop().create_future()
+        await self.queue.put(("order", (order, items), fut))
+        return await fut
+
+    async def submit(self, fn, *args):
+        # thao tác ghi khác (vd Product.add_product_db) cũng đi qua writer để giữ thứ tự
+        fut = asyncio.get_running_loop().create_future()
+        await self.queue.put(("call", (fn, args), fut))
+        return await fut
+
+    async def _run(self):
+        while True:
+            job = await self.queue.get()
+            if job is None:
+                return
+
+            batch = [job]
+            stopping = False
+            # chờ thêm 1 chút để gom các request tới gần như cùng lúc
+            if self.queue.empty() and self.max_wait > 0:
+                await asyncio.sleep(self.max_wait)
+            while len(batch) < self.max_batch and not self.queue.empty():
+                job = self.queue.get_nowait()
+                if job is None:
+                    stopping = True
+                    break
+                batch.append(job)
+
+            await self._process(batch)
+            if stopping:
+                return
+
+    async def _process(self, batch):
+        loop = asyncio.get_running_loop()
+
+        # giữ đúng thứ tự: các đơn liền nhau gom thành 1 group commit, call khác chạy riêng
+        i = 0
+        while i < len(batch):
+            kind, payload, fut = batch[i]
+            if kind == "call":
+                fn, args = payload
+                try:
+                    res = await loop.run_in_executor(self._executor, fn, *args)
+                except Exception as e:
+                    _set_exception(fut, e)
+                else:
+                    _set_result(fut, res)
+                i += 1
+                continue
+
+            j = i
+            while j < len(batch) and batch[j][0] == "order":
+                j += 1
+            group = batch[i:j]
+            try:
+                results = await loop.run_in_executor(
+                    self._executor, Order.place_orders_db, [payload for _, payload, _ in group]
+                )
+            except Exception as e:
+                # lỗi cả transaction (I/O, lock...) => mọi đơn trong nhóm đều fail
+                for _, _, f in group:
+                    _set_exception(f, e)
+            else:
+                for (_, _, f), res in zip(group, results):
+                    _set_result(f, res)
+            i = j
+
+
+def _set_result(fut, res):
+    if not fut.done():
+        fut.set_result(res)
+
+def _set_exception(fut, e):
+    if not fut.done():
+        fut.set_exception(e)